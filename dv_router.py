@@ -1,5 +1,9 @@
 """Your awesome Distance Vector router for CS 168."""
 
+from collections import OrderedDict
+import heapq
+import itertools
+
 import sim.api as api
 import sim.basics as basics
 
@@ -10,6 +14,7 @@ class DVRouter(basics.DVRouterBase):
     # NO_LOG = True # Set to True on an instance to disable its logging
     # POISON_MODE = True # Can override POISON_MODE here
     # DEFAULT_TIMER_INTERVAL = 5 # Can override this yourself for testing
+    POISON_ROUNDS = 1 # How many periodic updates to send each poison in
 
     def __init__(self):
         """
@@ -18,11 +23,33 @@ class DVRouter(basics.DVRouterBase):
         You probably want to do some additional initialization here.
 
         """
-        self.destinations_to_poison = [] # Expired routes whose destinations we should poison
+        # Expired routes whose destinations we should poison, and how many
+        # more periodic updates to poison them in
+        self.destinations_to_poison = OrderedDict()
         self.host_to_port = {}
         # Store things as (port, latency, creation_time) pairs"""
-        self.routing_table = {}
+        if self.COMPACT_TABLE:
+            self.routing_table = basics.RoutingTable()
+            # Read straight out of the table, without making tuples
+            self.get_routing_port = self.routing_table.get_port
+            self.get_routing_distance = self.routing_table.get_distance
+            self.get_creation_time = self.routing_table.get_time
+        else:
+            self.routing_table = {}
         self.port_to_latency = {}
+        # Reverse indexes: port -> {destination or host: None}.  (Dicts
+        # rather than sets so that they keep a predictable order.)
+        self.port_to_destinations = {}
+        self.port_to_hosts = {}
+        # For triggered updates: port -> destinations to tell it about
+        self.pending_updates = {}
+        self.last_update = {} # port -> time of last triggered update
+        # port -> {destination: time we last sent it a route for it}
+        self.last_advertised = {}
+        # Min-heap of (creation_time, count, destination) for route expiry.
+        # Entries for routes that have since changed are just skipped.
+        self.expiry_heap = []
+        self.expiry_count = itertools.count()
         self.start_timer()  # Starts calling handle_timer() at correct rate
 
     def handle_link_up(self, port, latency):
@@ -36,19 +63,48 @@ class DVRouter(basics.DVRouterBase):
         self.port_to_latency[port] = latency
         self.send_dv_to_port(port)
 
-    def send_dv_to_port(self, port):
-        for destination in self.routing_table:
-            routing_port = self.get_routing_port(destination)
-            latency = self.get_routing_distance(destination)
-            if (routing_port != port):
-                self.send_routing_packet(destination, port,latency)
-            elif (self.POISON_MODE): # routing_port = port. Poison reverse
-                self.send_routing_packet(destination, port, INFINITY)
-            # else do nothing for split horizon
-        if self.POISON_MODE:
-            for destination in self.destinations_to_poison:
-                if destination not in self.host_to_port: # hosts always have routes
-                    self.send_routing_packet(destination, port, INFINITY)
+    def send_dv_to_port(self, port, destinations=None):
+        # Sends routes for the given destinations (default is all of them)
+        routes = []
+        if destinations is None:
+            for destination in self.routing_table:
+                self.add_route_for_port(routes, destination, port)
+            if self.POISON_MODE:
+                for destination in self.destinations_to_poison:
+                    if destination not in self.host_to_port: # hosts always have routes
+                        routes.append((destination, INFINITY))
+        else:
+            for destination in destinations:
+                if destination in self.routing_table:
+                    self.add_route_for_port(routes, destination, port)
+                elif (self.POISON_MODE and
+                      destination not in self.host_to_port):
+                    routes.append((destination, INFINITY))
+        if self.TRIGGERED_UPDATES:
+            now = api.current_time()
+            advertised = self.last_advertised.setdefault(port, {})
+            for destination, _ in routes:
+                advertised[destination] = now
+        self.send_routes(port, routes)
+
+    def add_route_for_port(self, routes, destination, port):
+        routing_port = self.get_routing_port(destination)
+        latency = self.get_routing_distance(destination)
+        if (routing_port != port):
+            routes.append((destination, latency))
+        elif (self.POISON_MODE): # routing_port = port. Poison reverse
+            routes.append((destination, INFINITY))
+        # else do nothing for split horizon
+
+    def send_routes(self, out_port, routes):
+        # One packet for all the routes, or one packet per route
+        if self.SEND_VECTORS:
+            if routes:
+                packet = basics.RouteVectorPacket(routes)
+                self.send(packet, port=out_port, flood=False)
+        else:
+            for destination, latency in routes:
+                self.send_routing_packet(destination, out_port, latency)
 
     def send_routing_packet(self, destination, out_port, latency):
         packet = basics.RoutePacket(destination, latency)
@@ -64,26 +120,20 @@ class DVRouter(basics.DVRouterBase):
         self.remove_hosts_on_port(port) # Must be before next line
         deleted_routes = self.remove_paths_using_port(port)
         del self.port_to_latency[port]
+        self.pending_updates.pop(port, None)
+        self.last_advertised.pop(port, None)
 
     def remove_paths_using_port(self, port):
         # Returns list of destinations that were removed
         current_time = api.current_time()
-        removed_destinations = []
-        for destination in self.routing_table:
-            out_port = self.get_routing_port(destination)
-            if (port == out_port):
-                removed_destinations.append(destination)
+        removed_destinations = list(self.port_to_destinations.get(port, ()))
         for destination in removed_destinations:
             self.remove_route(destination)
             # ALways maintain path to connected host
             self.add_default_host_route(destination, current_time)
 
     def remove_hosts_on_port(self, port):
-        hosts_to_remove = []
-        for host in self.host_to_port:
-            out_port = self.host_to_port[host]
-            if (port == out_port):
-                hosts_to_remove.append(host)
+        hosts_to_remove = self.port_to_hosts.pop(port, {})
         for host in hosts_to_remove:
             del self.host_to_port[host]
 
@@ -100,6 +150,8 @@ class DVRouter(basics.DVRouterBase):
         #self.log("RX %s on %s (%s)", packet, port, api.current_time())
         if isinstance(packet, basics.RoutePacket):
             self.handle_route_packet(packet,port)
+        elif isinstance(packet, basics.RouteVectorPacket):
+            self.handle_route_vector_packet(packet, port)
         elif isinstance(packet, basics.HostDiscoveryPacket):
             self.handle_host_discovery_packet(packet, port)
         else:
@@ -110,13 +162,37 @@ class DVRouter(basics.DVRouterBase):
         destination = packet.destination
         self.update_route(destination, port, latency)
 
+    def handle_route_vector_packet(self, packet, port):
+        # Same as getting a RoutePacket for each route, in order
+        for destination, latency in packet.routes:
+            self.update_route(destination, port, latency)
+
     def update_route(self, destination, port, latency):
+        if not self.TRIGGERED_UPDATES:
+            self._update_route(destination, port, latency)
+            return
+        had_route = destination in self.routing_table
+        if had_route:
+            old_port = self.get_routing_port(destination)
+            old_distance = self.get_routing_distance(destination)
+        self._update_route(destination, port, latency)
+        if (not had_route or destination not in self.routing_table or
+                old_distance != self.get_routing_distance(destination)):
+            self.route_changed(destination)
+        else:
+            new_port = self.get_routing_port(destination)
+            if old_port != new_port:
+                # Same distance, different next hop.  That only changes
+                # what we tell the old and new next hops (split horizon).
+                self.route_changed(destination, (old_port, new_port))
+
+    def _update_route(self, destination, port, latency):
         creation_time = api.current_time()
         port_latency = self.port_to_latency[port]
         total_distance = self.add_latencies(latency, port_latency)
         if (destination not in self.routing_table):
             if total_distance != INFINITY:
-                self.routing_table[destination] = (port, total_distance, creation_time)
+                self.set_route(destination, port, total_distance, creation_time)
         else: # Destination in routing table
             prev_port = self.get_routing_port(destination)
             prev_latency = self.get_routing_distance(destination)
@@ -124,16 +200,65 @@ class DVRouter(basics.DVRouterBase):
                 if total_distance == INFINITY:
                     self.remove_route(destination)
                 else: # Always trust the most recent
-                    self.routing_table[destination] = (port, total_distance, creation_time)
+                    self.set_route(destination, port, total_distance, creation_time)
             elif (total_distance <= prev_latency):
-                self.routing_table[destination] = (port, total_distance, creation_time)
+                self.set_route(destination, port, total_distance, creation_time)
         self.add_default_host_route(destination, creation_time) # Make sure host always has route
 
+    def set_route(self, destination, port, distance, creation_time):
+        # Don't poison it if we have a route again
+        self.destinations_to_poison.pop(destination, None)
+        if destination in self.routing_table:
+            self.forget_port_of(destination)
+        self.port_to_destinations.setdefault(port, {})[destination] = None
+        if self.COMPACT_TABLE:
+            self.routing_table.set(destination, port, distance, creation_time)
+        else:
+            self.routing_table[destination] = (port, distance, creation_time)
+        heapq.heappush(self.expiry_heap,
+                       (creation_time, next(self.expiry_count), destination))
+
     def remove_route(self, destination):
         if destination in self.routing_table:
+            self.forget_port_of(destination)
             del self.routing_table[destination]
             if self.POISON_MODE: # Route poisoning
-                self.destinations_to_poison.append(destination)
+                self.destinations_to_poison[destination] = self.POISON_ROUNDS
+            self.route_changed(destination)
+
+    def forget_port_of(self, destination):
+        # Takes destination out of the reverse index for its current port
+        port = self.get_routing_port(destination)
+        destinations = self.port_to_destinations[port]
+        del destinations[destination]
+        if not destinations:
+            del self.port_to_destinations[port]
+
+    def route_changed(self, destination, ports=None):
+        # Queue up a triggered update about destination for the given ports
+        # (default is every neighbor)
+        if not self.TRIGGERED_UPDATES:
+            return
+        if ports is None:
+            ports = self.get_neighbors()
+        for port in ports:
+            if port not in self.port_to_latency:
+                continue
+            pending = self.pending_updates.get(port)
+            if pending is None:
+                pending = self.pending_updates[port] = OrderedDict()
+                wait = (self.last_update.get(port, -self.HOLD_DOWN)
+                        + self.HOLD_DOWN - api.current_time())
+                api.create_timer(max(0, wait), self.send_pending_updates,
+                                 recurring=False, args=(port,))
+            pending[destination] = True
+
+    def send_pending_updates(self, port):
+        pending = self.pending_updates.pop(port, None)
+        if pending is None or port not in self.port_to_latency:
+            return
+        self.last_update[port] = api.current_time()
+        self.send_dv_to_port(port, list(pending))
 
     def add_latencies(self, lat1, lat2):
         return min(lat1 + lat2, INFINITY)
@@ -144,13 +269,17 @@ class DVRouter(basics.DVRouterBase):
             host_port = self.host_to_port[destination]
             new_latency = self.port_to_latency[host_port]
             if (destination not in self.routing_table):
-                self.routing_table[destination] = (host_port, new_latency, creation_time)
+                self.set_route(destination, host_port, new_latency, creation_time)
             elif (new_latency < self.get_routing_distance(destination)):
-                self.routing_table[destination] = (host_port, new_latency, creation_time)
+                self.set_route(destination, host_port, new_latency, creation_time)
 
     def handle_host_discovery_packet(self, packet, port):
         host = packet.src
+        old_port = self.host_to_port.get(host)
+        if old_port is not None and old_port != port:
+            del self.port_to_hosts[old_port][host]
         self.host_to_port[host] = port
+        self.port_to_hosts.setdefault(port, {})[host] = None
         self.update_route(host, port, 0.0)
 
     def handle_data_packet(self, packet, port):
@@ -175,10 +304,15 @@ class DVRouter(basics.DVRouterBase):
     def remove_expired_entries(self):
         current_time = api.current_time()
         entries_to_remove = []
-        for destination in self.routing_table:
-            creation_time = self.get_creation_time(destination)
-            time_elapsed = current_time - creation_time
-            if time_elapsed >= self.ROUTE_TIMEOUT:
+        seen = set() # The same route can be in the heap more than once
+        heap = self.expiry_heap
+        # Only look at the oldest entries, which are the ones that can expire
+        while heap and current_time - heap[0][0] >= self.ROUTE_TIMEOUT:
+            creation_time, _, destination = heapq.heappop(heap)
+            if (destination in self.routing_table and
+                    self.get_creation_time(destination) == creation_time and
+                    destination not in seen):
+                seen.add(destination)
                 entries_to_remove.append(destination)
         for destination in entries_to_remove:
             self.remove_route(destination)
@@ -186,8 +320,36 @@ class DVRouter(basics.DVRouterBase):
 
     def send_table_to_neighbors(self):
         for port in self.get_neighbors():
-            self.send_dv_to_port(port)
-        self.destinations_to_poison = []
+            if self.TRIGGERED_UPDATES:
+                self.send_refresh_to_port(port)
+            else:
+                self.send_dv_to_port(port)
+            # They're getting everything, so no need for triggered updates
+            self.pending_updates.pop(port, None)
+        poison = self.destinations_to_poison
+        for destination in list(poison):
+            poison[destination] -= 1
+            if poison[destination] <= 0:
+                del poison[destination]
+
+    def send_refresh_to_port(self, port):
+        # With triggered updates, neighbors already hear about changes, so
+        # we only resend routes that they might time out before the next
+        # timer (plus anything waiting for a triggered update, and poison)
+        refresh_age = self.ROUTE_TIMEOUT - 1.5 * self.DEFAULT_TIMER_INTERVAL
+        cutoff = api.current_time() - refresh_age
+        advertised = self.last_advertised.get(port, {})
+        pending = self.pending_updates.get(port, {})
+        destinations = OrderedDict()
+        for destination in self.routing_table:
+            if (advertised.get(destination, cutoff) <= cutoff or
+                    destination in pending):
+                destinations[destination] = None
+        for destination in pending:
+            destinations[destination] = None
+        for destination in self.destinations_to_poison:
+            destinations[destination] = None
+        self.send_dv_to_port(port, list(destinations))
 
     def get_neighbors(self):
         return self.port_to_latency.keys()
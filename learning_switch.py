@@ -31,6 +31,8 @@ class LearningSwitch(api.Entity):
 
         """
         self.routing_table = {}
+        # port -> {source: None} for the sources learned on that port
+        self.port_to_sources = {}
 
     def handle_link_down(self, port):
         """
@@ -41,9 +43,8 @@ class LearningSwitch(api.Entity):
 
         """
         # Delete table entries that use this port
-        for key, val in self.routing_table.items():
-            if val == port:
-                del self.routing_table[key]
+        for source in self.port_to_sources.pop(port, {}):
+            del self.routing_table[source]
 
     def handle_rx(self, packet, in_port):
         """
@@ -67,7 +68,12 @@ class LearningSwitch(api.Entity):
 
         source = packet.src
         destination = packet.dst
-        self.routing_table[source] = in_port
+        old_port = self.routing_table.get(source)
+        if old_port != in_port:
+            if old_port is not None:
+                del self.port_to_sources[old_port][source]
+            self.port_to_sources.setdefault(in_port, {})[source] = None
+            self.routing_table[source] = in_port
 
         if destination in self.routing_table:
             out_port = self.routing_table[destination]
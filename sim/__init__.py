@@ -30,6 +30,28 @@ class SimConfiguration(object):
     remote_interface_address = "127.0.0.1"
     remote_interface_port = 4444
 
+    # Which kind of event queue the World uses; see sim.core.event_queue_types
+    event_queue = "heap"
+
+    # End a virtual time simulation as soon as it runs out of events (unless
+    # something like the console or a NetVis connection may add more)
+    idle_exit = True
+
+    # Seed for the World's random numbers (None picks one at random)
+    seed = None
+
+    # Give packets random colors for NetVis?  None means only if something
+    # is actually watching.
+    packet_colors = None
+
+    # Fraction of packets to show in NetVis (when it's connected).  Dropped
+    # packets are always shown.
+    packet_event_rate = 1.0
+
+    # Batch up recurring timers in a sim.core.TimerWheel?
+    timer_wheel = False
+    timer_wheel_resolution = 0
+
     @property
     def default_switch_type(self):
         if self._default_switch_type:
@@ -1,8 +1,8 @@
 """The main APIs for the simulator."""
 
 from __future__ import print_function
+import copy
 import sim.core as core
-from random import random as rand
 
 # Non-routable packets may not really have addresses.  We just create a
 # more meaningful name for None for these cases.
@@ -41,6 +41,9 @@ def create_timer(seconds,
     itself as a final positional argument if pass_self is True. You can
     call .cancel() on the returned timer object to cancel it.
 
+    Recurring timers are batched together in a timer wheel if the
+    simulator was started with --timer-wheel.
+
     """
     if recurring:
         return core.Timer(
@@ -193,9 +196,103 @@ def hsv_to_rgb(h, s, v, a=1):
     return [r, g, b, a]
 
 
+class _CopyOnWrite(object):
+    """
+    A packet field which duplicates of the packet share until it's touched.
+
+    When a packet is sent out of several ports, each copy shares the
+    original's containers (e.g., the color lists) rather than getting its
+    own copies right away.  The first time a copy (or the original) actually
+    accesses the field, it gets its own copy.  The shared value lives in
+    the slot named storage, and bit says which bit of _shared marks it as
+    still being shared.
+
+    """
+
+    def __init__(self, storage, bit, doc=None):
+        self.storage = storage
+        self.bit = bit
+        self.__doc__ = doc
+
+    def __get__(self, packet, cls=None):
+        if packet is None:
+            return self
+        v = getattr(packet, self.storage)
+        if packet._shared & self.bit:
+            packet._shared &= ~self.bit
+            v = v[:] if type(v) is list else copy.copy(v)
+            setattr(packet, self.storage, v)
+        return v
+
+    def __set__(self, packet, value):
+        packet._shared &= ~self.bit
+        setattr(packet, self.storage, value)
+
+
+class _TraceNode(object):
+    """
+    One hop of a packet's trace.
+
+    Rather than a list that has to be copied along with the packet at every
+    hop, a trace is normally kept as a chain of these, each pointing back
+    at the previous hop.  They're never modified, so duplicates of a packet
+    can share them, and adding a hop is O(1).  Packet.trace turns the chain
+    into a normal list when someone actually wants one.
+
+    """
+    __slots__ = ('entity', 'parent')
+
+    def __init__(self, entity, parent):
+        self.entity = entity
+        self.parent = parent
+
+    @staticmethod
+    def to_list(node):
+        r = []
+        while node is not None:
+            r.append(node.entity)
+            node = node.parent
+        r.reverse()
+        return r
+
+
+class _TraceField(_CopyOnWrite):
+    """The trace field, which may be either a list or a _TraceNode chain."""
+
+    def __get__(self, packet, cls=None):
+        if packet is None:
+            return self
+        v = packet._trace
+        if v is None or type(v) is _TraceNode:
+            # From now on it's a plain list which belongs to this packet
+            v = _TraceNode.to_list(v)
+            packet._trace = v
+            packet._shared &= ~self.bit
+            return v
+        return _CopyOnWrite.__get__(self, packet, cls)
+
+
 class Packet(object):
     DEFAULT_TTL = 20
 
+    # Packets use __slots__ rather than a __dict__ to save memory, since
+    # there can be an awful lot of them.  This means you can't just stick a
+    # new attribute on a Packet (or on a Ping, Pong, RoutePacket, etc.);
+    # that raises AttributeError.  Make a subclass instead.  Subclasses
+    # which don't define __slots__ get a __dict__ as usual, so you can add
+    # whatever fields you like to them.  Subclasses which also define
+    # __slots__ (listing only their *new* fields) stay compact.
+    __slots__ = ('src', 'dst', 'ttl', '_trace', '_outer_color',
+                 '_inner_color', '_shared')
+
+    # These are copy-on-write between duplicates of a packet (see
+    # _CopyOnWrite and core._duplicate_packet()).
+    _SHARED_ALL = 1 | 2 | 4
+    trace = _TraceField('_trace', 1,
+                        "List of entities we've been sent through.")
+    outer_color = _CopyOnWrite('_outer_color', 2, "Outer color for NetVis.")
+    inner_color = _CopyOnWrite('_inner_color', 4, "Inner color for NetVis.")
+
     def __init__(self, dst=NullAddress, src=NullAddress):
         """
         Base class for all packets.
@@ -210,19 +307,26 @@ class Packet(object):
         (containing primitive types or more plain 'ol containers containing...).
 
         """
+        self._shared = 0  # Bits for fields we share with duplicates
         self.src = src
         self.dst = dst
         # Decremented for each entity we go through.
         self.ttl = self.DEFAULT_TTL
-        # List of entities we've been sent through.  For debugging.
-        self.trace = []
+        # List of entities we've been sent through.  For debugging.  (It's
+        # kept as a chain of _TraceNodes until someone asks for a list.)
+        self._trace = None
 
         # When using NetVis, packets are visible, and you can set the color.
         # color is a list of red, green, blue, and (optionally) alpha values.
         # Each value is between 0 and 1.  alpha of 0 is transparent.  1 is
         # opaque.
-        self.outer_color = hsv_to_rgb(rand(), rand() * .8 + .2,
-                                      rand() * .5 + .5, .75)
+        if core.world is not None and core.world.packet_colors:
+            rand = core.world.packet_random.random
+            self.outer_color = hsv_to_rgb(rand(), rand() * .8 + .2,
+                                          rand() * .5 + .5, .75)
+        else:
+            # Nobody's looking, so don't bother
+            self.outer_color = [.5, .5, .5, .75]
         self.inner_color = [0, 0, 0, 0]  # transparent
 
     def _notify_rx(self, srcEnt, srcPort, dstEnt, dstPort, drop):
@@ -233,7 +337,12 @@ class Packet(object):
 
         """
         if not drop:
-            self.trace.append(dstEnt)
+            trace = self._trace
+            if trace is None or type(trace) is _TraceNode:
+                self._trace = _TraceNode(dstEnt, trace)
+            else:
+                # Somebody turned it into a list
+                self.trace.append(dstEnt)
 
     def _notify_tx(self, srcEnt, srcPort, dstEnt, dstPort, drop):
         """
@@ -1,5 +1,11 @@
 """Subclasses of simulator API things."""
 
+from array import array
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 import sim.api as api
 
 
@@ -54,6 +60,7 @@ class BasicHost(api.HostEntity):
 
 class Ping(api.Packet):
     """A Ping packet."""
+    __slots__ = ('data', )
 
     def __init__(self, dst, data=None, color=None):
         super(Ping, self).__init__(dst=dst)
@@ -83,6 +90,7 @@ class Pong(api.Packet):
     property.
 
     """
+    __slots__ = ('original', )
 
     def __init__(self, original):
         super(Pong, self).__init__(dst=original.src)
@@ -98,6 +106,7 @@ class Pong(api.Packet):
 
 class HostDiscoveryPacket(api.Packet):
     """Just a way that hosts say hello."""
+    __slots__ = ()
 
     def __init__(self, *args, **kw):
         # Call original constructor
@@ -107,6 +116,8 @@ class HostDiscoveryPacket(api.Packet):
 
 
 class RoutePacket(api.Packet):
+    __slots__ = ('latency', 'destination')
+
     def __init__(self, destination, latency):
         super(RoutePacket, self).__init__()
         self.latency = latency
@@ -119,9 +130,122 @@ class RoutePacket(api.Packet):
                                                    self.latency)
 
 
+class RouteVectorPacket(api.Packet):
+    """
+    A whole batch of routes in one packet.
+
+    routes is a list of (destination, latency) pairs, and means the same
+    thing as a RoutePacket for each of them, in order.
+
+    """
+    __slots__ = ('routes',)
+
+    def __init__(self, routes):
+        super(RouteVectorPacket, self).__init__()
+        self.routes = routes
+        self.outer_color = [1, 0, 1, 1]
+        self.inner_color = [1, 0, 1, 1]
+
+    def __repr__(self):
+        return "<RouteVectorPacket with %s routes>" % (len(self.routes), )
+
+
+class RoutingTable(MutableMapping):
+    """
+    A compact table of destination -> (port, distance, time).
+
+    It works like a dict (so table[dst] = (port, distance, time) and
+    "for dst in table" are fine), but the values are kept in arrays rather
+    than in a tuple per route.  Each destination gets the next slot in the
+    arrays when it's first added.  Use get_port(), get_distance(),
+    get_time() and set() to avoid making tuples.
+
+    Like a dict, iteration is in the order destinations were added.
+
+    """
+    def __init__(self, *args, **kw):
+        self._slots = {}  # destination -> slot
+        self._keys = []  # slot -> destination (or None if deleted)
+        self._ports = array('l')
+        self._distances = array('d')
+        self._times = array('d')
+        self.update(*args, **kw)
+
+    def _compact(self):
+        """Squeezes out the slots of deleted destinations."""
+        live = [i for i, k in enumerate(self._keys) if k is not None]
+        self._keys = [self._keys[i] for i in live]
+        self._ports = array('l', [self._ports[i] for i in live])
+        self._distances = array('d', [self._distances[i] for i in live])
+        self._times = array('d', [self._times[i] for i in live])
+        self._slots = dict((k, i) for i, k in enumerate(self._keys))
+
+    def set(self, destination, port, distance, time):
+        i = self._slots.get(destination)
+        if i is None:
+            self._slots[destination] = len(self._keys)
+            self._keys.append(destination)
+            self._ports.append(port)
+            self._distances.append(distance)
+            self._times.append(time)
+        else:
+            self._ports[i] = port
+            self._distances[i] = distance
+            self._times[i] = time
+
+    def get_port(self, destination):
+        return self._ports[self._slots[destination]]
+
+    def get_distance(self, destination):
+        return self._distances[self._slots[destination]]
+
+    def get_time(self, destination):
+        return self._times[self._slots[destination]]
+
+    def __getitem__(self, destination):
+        i = self._slots[destination]
+        return (self._ports[i], self._distances[i], self._times[i])
+
+    def __setitem__(self, destination, value):
+        port, distance, time = value
+        self.set(destination, port, distance, time)
+
+    def __delitem__(self, destination):
+        i = self._slots.pop(destination)
+        self._keys[i] = None
+        # Don't let deleted slots take over
+        if len(self._keys) > 2 * len(self._slots) + 8:
+            self._compact()
+
+    def __contains__(self, destination):
+        try:
+            return destination in self._slots
+        except TypeError:  # Unhashable
+            return False
+
+    def __iter__(self):
+        return (k for k in self._keys if k is not None)
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, dict(self.items()))
+
+
 class DVRouterBase(api.Entity):
     """Base class for implementing a distance vector router."""
     POISON_MODE = False  # If self.POISON_MODE is True, send poisons.
+    # If True, send all the routes for a neighbor in one RouteVectorPacket
+    # instead of a RoutePacket for each.
+    SEND_VECTORS = False
+    # If True, send changed routes to neighbors right away (but no more than
+    # once every HOLD_DOWN seconds per neighbor) as well as periodically.
+    TRIGGERED_UPDATES = False
+    HOLD_DOWN = 1
+    # If True, keep routes in a RoutingTable instead of a dict.  It takes
+    # less memory, but lookups are a bit slower.
+    COMPACT_TABLE = False
     DEFAULT_TIMER_INTERVAL = 5  # Default timer interval.
     ROUTE_TIMEOUT = 15  # Routes should time out after 15 seconds.
 
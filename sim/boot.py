@@ -88,8 +88,6 @@ def main():
             return
         pymods.append((name, m))
 
-    post_options(**remaining)
-
     import sim.api
     sim.api.netvis.info = _netvis_welcome
 
@@ -114,6 +112,13 @@ def main():
             except:
                 pass
         interp = code.InteractiveConsole(locals=variables)
+        # The console may add events, so the world shouldn't end when it
+        # runs out (this has to happen before --start starts it)
+        core.world.add_producer(interp)
+
+    post_options(**remaining)
+
+    if sim.config.interactive:
         interp.interact("")
     else:
         # Non-interactive always starts automatically
@@ -134,6 +139,16 @@ def pre_options(default_host_type=None,
                 readline=True,
                 virtual_time=False,
                 poison_mode=None,
+                route_vectors=None,
+                triggered_updates=None,
+                compact_table=None,
+                event_queue="heap",
+                idle_exit=True,
+                timer_wheel=False,
+                timer_wheel_resolution=0,
+                seed=None,
+                packet_colors=None,
+                packet_event_rate=1.0,
                 **kw):
     """
     Set up initial options and create world.
@@ -165,11 +180,25 @@ def pre_options(default_host_type=None,
 
     if poison_mode is not None:
         sim.config.default_switch_type.POISON_MODE = poison_mode
+    if route_vectors is not None:
+        sim.config.default_switch_type.SEND_VECTORS = route_vectors
+    if triggered_updates is not None:
+        sim.config.default_switch_type.TRIGGERED_UPDATES = triggered_updates
+    if compact_table is not None:
+        sim.config.default_switch_type.COMPACT_TABLE = compact_table
 
     sim.config.remote_interface = remote_interface
     sim.config.remote_interface_port = remote_interface_port
     sim.config.remote_interface_address = remote_interface_address
 
+    sim.config.event_queue = event_queue
+    sim.config.idle_exit = idle_exit
+    sim.config.timer_wheel = timer_wheel
+    sim.config.timer_wheel_resolution = timer_wheel_resolution
+    sim.config.seed = seed
+    sim.config.packet_colors = packet_colors
+    sim.config.packet_event_rate = float(packet_event_rate)
+
     if interactive:
         print(_console_welcome)
 
@@ -1,6 +1,16 @@
 """Cables are how Entities are connected."""
 
+import bisect
+import heapq
+import itertools
 import random
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import sim.core as core
 
 
@@ -37,6 +47,14 @@ class Cable(object):
         """Return the list of things we're connected to."""
         pass
 
+    def _packet_event(self, packet, drop=False):
+        """Tells the GUI (if it cares) about a packet going over this cable."""
+        events = core.events
+        # Drops get shown even when packet_event_rate is 0
+        if events.wants_packet_events or (drop and events.has_viewers):
+            events.packet(self.srcEnt.name, self.dstEnt.name, packet,
+                          self.latency, drop=drop)
+
     def _handle_disconnect(self):
         """Called when cable is disconnected from devices."""
         pass
@@ -54,17 +72,24 @@ class DumbCable(Cable):
         if latency is not None:
             self.latency = latency
 
-    def transfer(self, packet):
+    def min_delay(self):
+        """The least time between transfer() and delivery (for sim.pdes)."""
+        return self.latency
+
+    def _enqueue(self, t, packet):
+        """Arranges for packet to be delivered at time t."""
         def rx():
             packet._notify_rx(self.srcEnt, self.srcPort, self.dstEnt,
                               self.dstPort, False)
 
             self.dstEnt.handle_rx(packet, self.dstPort)
 
-        core.world.doLater(self.latency, rx)
+        core.world.doAt(t, rx)
 
-        core.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
-                           self.latency)
+    def transfer(self, packet):
+        self._enqueue(core.world.time + self.latency, packet)
+
+        self._packet_event(packet)
         packet._notify_tx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
                           False)
 
@@ -81,9 +106,24 @@ class BasicCable(DumbCable):
     DEFAULT_QUEUE_SIZE = None  # Unlimited
     DEFAULT_TX_TIME = 0.1  # Transmission delay
 
+    # Check that the queue is in delivery order every time it's scheduled.
+    # This is slow, so it's only meant for debugging.
+    CHECK_ORDER = False
+
     def __init__(self, *args, **kw):
         self.size = kw.pop("queue_size", self.DEFAULT_QUEUE_SIZE)
-        self.queue = []  # time, packet
+        # (time, packet), in delivery order.  Since packets go out one after
+        # another and the latency is the same for all of them, they arrive
+        # in the order they were sent, so this is just a FIFO.
+        self.queue = deque()
+        # If the latency changes while packets are queued, they may need to
+        # be delivered out of order.  Until the queue drains, everything goes
+        # in this heap of (time, count, packet) instead.
+        self._heap = None
+        self._heap_count = itertools.count()
+        self._heap_last = None  # Most recent heap entry
+        # The one pending deliver() event (if any), and when it's for
+        self._delivery = None
         self.next_delivery = None
 
         super(BasicCable, self).__init__(*args, **kw)
@@ -92,44 +132,77 @@ class BasicCable(DumbCable):
 
         self._tx_stop = None  # Time at which current transfer ends (or None)
 
+    def _queue_length(self):
+        """Number of queued packets."""
+        if self._heap is not None:
+            return len(self._heap)
+        return len(self.queue)
+
     def drop(self):
-        del self.queue[-1]  # Tail drop
+        """Drops the packet which was most recently queued."""
+        if self._heap is None:
+            self.queue.pop()  # Tail drop
+        else:
+            self._heap.remove(self._heap_last)
+            heapq.heapify(self._heap)
+            self._heap_last = None
+
+    def _next_time(self):
+        """Time of the next delivery, or None if nothing is queued."""
+        if self._heap is not None:
+            return self._heap[0][0] if self._heap else None
+        return self.queue[0][0] if self.queue else None
+
+    def _pop(self):
+        """Removes the next packet to deliver and returns it."""
+        if self._heap is not None:
+            p = heapq.heappop(self._heap)[2]
+            if not self._heap:
+                self._heap = None  # Back to plain FIFO
+            return p
+        return self.queue.popleft()[1]
+
+    def _check_order(self):
+        q = self._heap if self._heap is not None else self.queue
+        times = [x[0] for x in q]
+        if self._heap is not None:
+            assert times[0] == min(times)
+        else:
+            assert all(a <= b for a, b in zip(times, times[1:]))
 
     def sched(self):
-        if not self.queue:
+        t = self._next_time()
+        if t is None:
             return
-        assert [
-            x[0] for x in self.queue
-        ] == [
-            x[0] for x in sorted(
-                self.queue, key=self._queue_key)
-        ]
-        # self.queue.sort() # We could do better than this! (And have,
-        # apparently)
-        t = self.queue[0][0]
-        self.next_delivery = None
-        if self.next_delivery is None or t < self.next_delivery:
-            self.next_delivery = t
-            core.world.doAt(t, self.deliver)
+        if self.CHECK_ORDER:
+            self._check_order()
+        if self._delivery is not None:
+            if t == self.next_delivery:
+                return  # Already armed for the right time
+            self._delivery.cancel()
+        self.next_delivery = t
+        self._delivery = core.world.doAt(t, self.deliver)
 
     def deliver(self):
         if self.src:
             self.old_src = self.src
         if self.dst:
             self.old_dst = self.dst
+        self._delivery = None
         self.next_delivery = None
         drop = False
         if not self.src or self.src.ports[self.srcPort] is not self:
-            if self.queue:
+            if self._queue_length():
                 # print "DISCONNECTED",self.old_src,self.old_dst, self.queue
                 drop = True
                 return
 
-        while self.queue:
-            if self.queue[0][0] > core.world.time:
+        now = core.world.time
+        while True:
+            t = self._next_time()
+            if t is None or t > now:
                 break
-            p = self.queue.pop(0)[1]
-            self._do_deliver(p, drop)
+            self._do_deliver(self._pop(), drop)
         self.sched()
 
     def _do_deliver(self, p, drop):
@@ -138,7 +211,11 @@ class BasicCable(DumbCable):
         if not drop:
             self.dstEnt.handle_rx(p, self.dstPort)
 
-    def transfer(self, packet):
+    def min_delay(self):
+        return self.tx_time + self.latency
+
+    def _arrival_time(self):
+        """Starts transmitting a packet and returns when it will arrive."""
         now = core.world.time
         tx_time = self.tx_time
         if self._tx_stop is None or now >= self._tx_stop:
@@ -149,31 +226,40 @@ class BasicCable(DumbCable):
             # Transfer in progress
             tx_at = self._tx_stop
             self._tx_stop += tx_time
-
-        self.queue.append((tx_at + tx_time + self.latency, packet))
-        if self.size is not None and len(self.queue) > self.size:
+        return tx_at + tx_time + self.latency
+
+    def _enqueue(self, t, packet):
+        queue = self.queue
+        if self._heap is None and queue and t < queue[-1][0]:
+            # Deliver last before second-to-last?  Switch to the heap.
+            count = self._heap_count
+            self._heap = [(qt, next(count), qp) for qt, qp in queue]
+            queue.clear()
+        if self._heap is None:
+            queue.append((t, packet))
+        else:
+            self._heap_last = (t, next(self._heap_count), packet)
+            heapq.heappush(self._heap, self._heap_last)
+        if self.size is not None and self._queue_length() > self.size:
             self.drop()
 
-        if len(self.queue) >= 2:
-            if self.queue[-1][0] < self.queue[-2][0]:
-                # Deliver last before second-to-last?
-                # Simple answer: just sort
-                self.queue.sort(key=self._queue_key)
-
         self.sched()
 
-        core.events.packet(self.srcEnt.name, self.dstEnt.name, packet,
-                           self.latency)
+    def transfer(self, packet):
+        self._enqueue(self._arrival_time(), packet)
+
+        self._packet_event(packet)
 
         packet._notify_tx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
                           False)
 
     def _handle_disconnect(self):
-        del self.queue[:]
-
-    @staticmethod
-    def _queue_key(queue_item):
-        return queue_item[0]
+        self.queue.clear()
+        self._heap = None
+        if self._delivery is not None:
+            self._delivery.cancel()
+            self._delivery = None
+            self.next_delivery = None
 
 
 class UnreliableCable(BasicCable):
@@ -197,16 +283,278 @@ class UnreliableCable(BasicCable):
         """Drop 10% by default."""
         super(UnreliableCable, self).__init__(latency=latency)
         self.drop_rate = drop
+        self.random = None
+
+    def initialize(self, src, srcport, dst, dstport):
+        super(UnreliableCable, self).initialize(src, srcport, dst, dstport)
+        # Each cable gets its own stream of random numbers
+        self.random = core.world.rng("cable %s.%s-%s.%s" % (
+            self.srcEnt.name, srcport, self.dstEnt.name, dstport))
+
+    def _lost(self):
+        """Decides whether the next packet gets dropped."""
+        return self.random.random() < self.drop_rate
 
     def transfer(self, packet):
         # It'd be nice if we called notify_tx and not notify_rx for dropped packets
         # or something, but that'd require more work. :)
-        if random.random() >= self.drop_rate:
+        if not self._lost():
             super(UnreliableCable, self).transfer(packet)
         else:
-            core.events.packet(
-                self.srcEnt.name,
-                self.dstEnt.name,
-                packet,
-                self.latency,
-                drop=True)
+            self._packet_event(packet, drop=True)
+
+
+class BurstyCable(UnreliableCable):
+    """
+    An UnreliableCable whose losses come in bursts.
+
+    Loss follows a Gilbert-Elliott model: the cable is either in a good
+    state, where it drops packets with probability drop, or a bad state,
+    where it drops them with probability bad_drop.  Before each packet, it
+    moves from good to bad with probability to_bad and from bad to good
+    with probability to_good.  It also drops everything during outage
+    windows (see add_outage()).
+
+    Random numbers are drawn a block at a time from a generator seeded
+    from the cable's World.rng() stream.  That uses NumPy if it's
+    available and random.Random if it's not, so the same seed gives
+    different (but still repeatable) losses with and without NumPy.
+
+    """
+    BLOCK_SIZE = 1024  # Random numbers to draw at a time
+
+    @classmethod
+    def pair(cls, *args, **kw):
+        """Create a pair of these (one for each direction)."""
+        return (cls(*args, **kw), cls(*args, **kw))
+
+    def __init__(self, latency=None, drop=0, bad_drop=1, to_bad=0,
+                 to_good=1, outages=()):
+        """
+        outages is a list of (start time, duration) windows during which
+        every packet is dropped.
+
+        """
+        super(BurstyCable, self).__init__(latency=latency, drop=drop)
+        self.bad_drop = bad_drop
+        self.to_bad = to_bad
+        self.to_good = to_good
+        self.bad = False  # In the bad state?
+        self._outages = []  # Sorted (start, end)
+        for start, duration in outages:
+            self.add_outage(start, duration)
+        self._generator = None
+        self._draws = []
+        self._next_draw = 0
+
+    def add_outage(self, start, duration):
+        """Drops every packet sent from time start until start+duration."""
+        bisect.insort(self._outages, (start, start + duration))
+
+    def _draw(self):
+        """Returns the next uniform random number in [0, 1)."""
+        if self._next_draw >= len(self._draws):
+            if self._generator is None:
+                seed = self.random.getrandbits(32)
+                if numpy is not None:
+                    self._generator = numpy.random.RandomState(seed)
+                else:
+                    self._generator = random.Random(seed)
+            if numpy is not None:
+                self._draws = self._generator.random_sample(
+                    self.BLOCK_SIZE).tolist()
+            else:
+                r = self._generator.random
+                self._draws = [r() for _ in range(self.BLOCK_SIZE)]
+            self._next_draw = 0
+        self._next_draw += 1
+        return self._draws[self._next_draw - 1]
+
+    def _in_outage(self):
+        now = core.world.time
+        outages = self._outages
+        while outages and outages[0][1] <= now:
+            del outages[0]  # Over
+        return bool(outages) and outages[0][0] <= now
+
+    def _lost(self):
+        if self.bad:
+            if self.to_good and self._draw() < self.to_good:
+                self.bad = False
+        elif self.to_bad and self._draw() < self.to_bad:
+            self.bad = True
+        if self._in_outage():
+            return True
+        rate = self.bad_drop if self.bad else self.drop_rate
+        if rate <= 0:
+            return False
+        if rate >= 1:
+            return True
+        return self._draw() < rate
+
+
+def route_vector_size(packet):
+    """
+    Size in bytes of a RouteVectorPacket.
+
+    That's a header plus a bit for each route, so a vector with one route
+    is the same size as a RoutePacket.
+
+    """
+    return 48 + 16 * len(packet.routes)
+
+
+route_vector_size.min_size = 64
+
+
+class BandwidthCable(BasicCable):
+    """
+    A cable with a link rate, packet sizes and a buffer measured in bytes.
+
+    Instead of every packet taking the same tx_time to send, a packet takes
+    (size in bits) / rate seconds, where the size comes from the packet's
+    class (see packet_sizes).  Packets waiting to be sent are limited to
+    buffer bytes.  When that's full, new packets are dropped (tail drop),
+    or if red is set, packets are dropped early with Random Early Detection.
+
+    The cable keeps counters (tx_packets, tx_bytes, dropped_packets,
+    dropped_bytes, peak_backlog) and can tell you its utilization().
+
+    """
+    DEFAULT_RATE = 1000000  # Bits per second
+    DEFAULT_BUFFER = None  # Bytes (None is unlimited)
+    DEFAULT_QUEUE_SIZE = None  # Use buffer instead (it's in bytes)
+    DEFAULT_PACKET_SIZE = 1000  # Bytes
+    # Packet class (or class name) -> size in bytes.  Subclasses match too.
+    # A size can also be a function which takes the packet and returns its
+    # size.  Give the function a min_size attribute if it can return less
+    # than the smallest other size (min_delay() needs to know).
+    DEFAULT_PACKET_SIZES = {
+        "HostDiscoveryPacket": 64,
+        "RoutePacket": 64,
+        "RouteVectorPacket": route_vector_size,
+        "Ping": 100,
+        "Pong": 100,
+    }
+    RED_WEIGHT = 0.002  # How quickly RED's average backlog follows it
+
+    @classmethod
+    def pair(cls, *args, **kw):
+        """Create a pair of these (one for each direction)."""
+        return (cls(*args, **kw), cls(*args, **kw))
+
+    def __init__(self, latency=None, rate=None, buffer=None, sizes=None,
+                 red=None):
+        """
+        rate is in bits per second and buffer in bytes.  sizes updates
+        DEFAULT_PACKET_SIZES.  red is None for tail drop, or a tuple of
+        (min bytes, max bytes, max drop probability).  There's no
+        queue_size; buffer limits the queue instead.
+
+        """
+        super(BandwidthCable, self).__init__(latency=latency)
+        self.rate = float(self.DEFAULT_RATE if rate is None else rate)
+        self.buffer = self.DEFAULT_BUFFER if buffer is None else buffer
+        self.packet_sizes = dict(self.DEFAULT_PACKET_SIZES)
+        if sizes:
+            self.packet_sizes.update(sizes)
+        self._sizes = {}  # Packet type -> size
+        self.red = red
+        self._red_avg = 0.0
+        self.random = None
+
+        self.tx_packets = 0
+        self.tx_bytes = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.peak_backlog = 0  # Most bytes ever waiting to be sent
+        self._busy_time = 0.0  # Total time spent sending (incl. scheduled)
+
+    def initialize(self, src, srcport, dst, dstport):
+        super(BandwidthCable, self).initialize(src, srcport, dst, dstport)
+        self.random = core.world.rng("cable %s.%s-%s.%s" % (
+            self.srcEnt.name, srcport, self.dstEnt.name, dstport))
+
+    def packet_size(self, packet):
+        """Returns the size of packet in bytes."""
+        t = type(packet)
+        size = self._sizes.get(t)
+        if size is None:
+            size = self.DEFAULT_PACKET_SIZE
+            for cls in t.__mro__:
+                if cls in self.packet_sizes:
+                    size = self.packet_sizes[cls]
+                    break
+                if cls.__name__ in self.packet_sizes:
+                    size = self.packet_sizes[cls.__name__]
+                    break
+            self._sizes[t] = size
+        if callable(size):
+            return size(packet)
+        return size
+
+    def min_delay(self):
+        sizes = [self.DEFAULT_PACKET_SIZE]
+        for size in self.packet_sizes.values():
+            if callable(size):
+                size = getattr(size, "min_size", 0)
+            sizes.append(size)
+        return min(sizes) * 8 / self.rate + self.latency
+
+    def backlog(self):
+        """Returns the number of bytes waiting to be sent."""
+        if self._tx_stop is None:
+            return 0
+        backlog = (self._tx_stop - core.world.time) * self.rate / 8
+        return max(0.0, round(backlog, 6))  # Round off float error
+
+    def utilization(self):
+        """Fraction of the time since the start that the link was busy."""
+        now = core.world.time
+        if now <= 0:
+            return 0.0
+        return (self._busy_time - self.backlog() * 8 / self.rate) / now
+
+    def _should_drop(self, size, backlog):
+        if self.buffer is not None and backlog + size > self.buffer:
+            return True
+        if self.red is None:
+            return False
+        low, high, max_p = self.red
+        self._red_avg += self.RED_WEIGHT * (backlog - self._red_avg)
+        if self._red_avg < low:
+            return False
+        if self._red_avg >= high:
+            return True
+        p = max_p * (self._red_avg - low) / (high - low)
+        return self.random.random() < p
+
+    def _arrival_time(self, size):
+        """Starts sending size bytes and returns when they'll arrive."""
+        now = core.world.time
+        tx_time = size * 8 / self.rate
+        if self._tx_stop is None or now >= self._tx_stop:
+            self._tx_stop = now + tx_time
+        else:
+            self._tx_stop += tx_time
+        self._busy_time += tx_time
+        return self._tx_stop + self.latency
+
+    def transfer(self, packet):
+        size = self.packet_size(packet)
+        backlog = self.backlog()
+        if self._should_drop(size, backlog):
+            self.dropped_packets += 1
+            self.dropped_bytes += size
+            self._packet_event(packet, drop=True)
+            return
+
+        self.tx_packets += 1
+        self.tx_bytes += size
+        self.peak_backlog = max(self.peak_backlog, backlog + size)
+        self._enqueue(self._arrival_time(size), packet)
+
+        self._packet_event(packet)
+
+        packet._notify_tx(self.srcEnt, self.srcPort, self.dstEnt, self.dstPort,
+                          False)
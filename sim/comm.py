@@ -5,6 +5,14 @@ that various events have occurred."""
 class NullInterface(object):
     """Interface that does nothing / base class."""
 
+    # Is anything (e.g., NetVis) watching?
+    has_viewers = False
+
+    # Should packet() be called for packets that get through?  (Cables check
+    # this first so that they don't bother when nobody is watching.  Drops
+    # only need has_viewers.)
+    wants_packet_events = False
+
     def send_console(self, text):
         pass
 
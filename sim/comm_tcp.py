@@ -3,21 +3,41 @@ viewer and NetVis."""
 
 import sim
 import sim.comm as comm
+from collections import deque
 import socket
 import json
 import threading
+import time
 import traceback
+import atexit
 
 import sim.core as core
 
 
 class StreamingConnection(comm.NullInterface):
+    # Most messages to hold for a client that isn't keeping up.  After this,
+    # the oldest ones get dropped.
+    MAX_PENDING = 10000
+
     def __init__(self, parent, sock):
         self.sock = sock
         self.parent = parent
+
+        # Messages waiting for the writer thread
+        self._pending = deque()
+        self._pending_lock = threading.Condition()
+        self._sending = False
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_messages = 0
+
         self.thread = threading.Thread(target=self._recvLoop)
         self.thread.daemon = True
         self.thread.start()
+        self.send_thread = threading.Thread(target=self._sendLoop)
+        self.send_thread.daemon = True
+        self.send_thread.start()
+        core.world.add_producer(self)
 
         def make(a, A, b, B):
             a = a.entity.name
@@ -130,21 +150,74 @@ class StreamingConnection(comm.NullInterface):
             node.disconnect()
 
     def send_raw(self, msg):
-        try:
-            self.sock.send(msg.encode())
-        except:
+        """Queues up msg for the writer thread.  Doesn't block."""
+        with self._pending_lock:
+            if self.sock is None:
+                return
+            if len(self._pending) >= self.MAX_PENDING:
+                self._pending.popleft()
+                if not self.dropped_messages:
+                    core.simlog.warning("Remote interface client isn't "
+                                        "keeping up; dropping messages")
+                self.dropped_messages += 1
+            self._pending.append(msg)
+            self._pending_lock.notify_all()
+
+    def _sendLoop(self):
+        # Sends everything that's queued up in one go
+        while True:
+            with self._pending_lock:
+                while not self._pending and self.sock is not None:
+                    self._pending_lock.wait()
+                sock = self.sock
+                if sock is None:
+                    break
+                msgs = self._pending
+                self._pending = deque()
+                self._sending = True
+            data = "".join(msgs).encode()
             try:
-                self.sock.close()
+                sock.sendall(data)
             except:
-                pass
+                break
+            with self._pending_lock:
+                self._sending = False
+                self.sent_messages += len(msgs)
+                self.sent_bytes += len(data)
+                self._pending_lock.notify_all()
+        self._close()
+        core.events._disconnect(self)
+
+    def flush(self, timeout=None):
+        """Waits (up to timeout seconds) for queued messages to be sent."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._pending_lock:
+            while self.sock is not None and (self._pending or self._sending):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                self._pending_lock.wait(remaining)
+
+    def _close(self):
+        with self._pending_lock:
+            sock = self.sock
             self.sock = None
-            # TODO: reopen?
-            pass
+            self._sending = False
+            self._pending.clear()
+            self._pending_lock.notify_all()
+        if sock is not None:
+            try:
+                sock.close()
+            except:
+                pass
 
 
 class StreamingInterface(object):
     def __init__(self):
         self.connections = []
+        self._packet_credit = 0.0  # For sampling packet events
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -155,6 +228,22 @@ class StreamingInterface(object):
         self.thread.daemon = True
         self.thread.start()
 
+        # Give clients a chance to get the last few messages
+        atexit.register(self.flush, 2)
+
+    def flush(self, timeout=None):
+        """Waits (up to timeout seconds) for connections to send everything."""
+        for c in list(self.connections):
+            c.flush(timeout)
+
+    @property
+    def has_viewers(self):
+        return bool(self.connections)
+
+    @property
+    def wants_packet_events(self):
+        return bool(self.connections) and sim.config.packet_event_rate > 0
+
     def _listenLoop(self):
         import select
         try:
@@ -171,10 +260,8 @@ class StreamingInterface(object):
         core.simlog.debug("No longer listening for remote interfaces")
 
     def _disconnect(self, con):
-        try:
-            con.sock.close()
-        except:
-            pass
+        core.world.remove_producer(con)
+        con._close()
         try:
             self.connections.remove(con)
             # print "con closed"
@@ -233,6 +320,13 @@ class StreamingInterface(object):
         })
 
     def packet(self, n1, n2, packet, duration, drop=False):
+        rate = sim.config.packet_event_rate
+        if rate < 1 and not drop:
+            # Only send every so many (but always show drops)
+            self._packet_credit += rate
+            if self._packet_credit < 1:
+                return
+            self._packet_credit -= 1
         m = {
             "type": "packet",
             "node1": n1,
@@ -10,12 +10,22 @@ project.  Also, pieces of the implementation will change during grading.
 from __future__ import print_function
 import sys
 import sim
+import bisect
 import copy
+import heapq
+import itertools
+import math
+import random
 import threading
 try:
     import queue as Queue
 except ImportError:
     import Queue
+try:
+    from threading import get_ident as _get_ident
+except ImportError:
+    from thread import get_ident as _get_ident
+from collections import deque
 import time
 import weakref
 
@@ -128,7 +138,8 @@ class Timer(object):
 
     def __init__(self, seconds, target=None, args=(), kw={}, passSelf=False):
         self.seconds = seconds
-        world.doLater(seconds, self.timeout)
+        self._event = None
+        self._schedule()
         self.func = target
         self.stopped = False
         self.args = list(args)
@@ -136,8 +147,19 @@ class Timer(object):
         if passSelf:
             self.args = [self] + self.args
 
+    def _schedule(self):
+        if world.timer_wheel is not None:
+            # The wheel doesn't hand back events; cancelled timers just
+            # fall out of it the next time their slot fires.
+            world.timer_wheel.add(self.seconds, self.timeout)
+        else:
+            self._event = world.doLater(self.seconds, self.timeout)
+
     def cancel(self):
         self.stopped = True
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
 
     def timer(self):
         if self.func:
@@ -147,9 +169,10 @@ class Timer(object):
         if self.stopped:
             return
         try:
+            self._event = None
             rv = self.timer()
-            if rv is not False:
-                world.doLater(self.seconds, self.timeout)
+            if rv is not False and not self.stopped:
+                self._schedule()
         except Exception:
             simlog.exception("Exception while executing a timer")
             # traceback.print_exc()
@@ -163,9 +186,13 @@ class OneShot(Timer):
 
     """
 
+    def _schedule(self):
+        self._event = world.doLater(self.seconds, self.timeout)
+
     def timeout(self):
         if self.stopped:
             return
+        self._event = None
         try:
             self.timer()
         except Exception:
@@ -173,6 +200,261 @@ class OneShot(Timer):
             # traceback.print_exc()
 
 
+class TimerWheel(object):
+    """
+    Fires recurring timers in batches.
+
+    Every distinct deadline gets a slot holding all the callbacks due then,
+    and only the slot itself goes into the World's queue.  Since recurring
+    timers which started together with the same period keep landing on the
+    same deadlines (e.g., all the routers' periodic timers), adding and
+    firing them is O(1) per timer instead of a heap push and pop each.
+
+    If resolution is nonzero, deadlines are rounded up to a multiple of it,
+    which lets timers started at slightly different times share slots (at
+    the cost of firing a bit late).
+
+    Enable with --timer-wheel.  Note that timers in a slot all run together,
+    so they may be ordered differently relative to other events that happen
+    at the very same time.
+
+    """
+
+    def __init__(self, resolution=0):
+        self.resolution = resolution
+        self.slots = {}  # deadline -> [callback, ...]
+
+    def add(self, seconds, callback):
+        deadline = world.time + seconds
+        if self.resolution:
+            deadline = math.ceil(deadline / self.resolution) * self.resolution
+        slot = self.slots.get(deadline)
+        if slot is None:
+            self.slots[deadline] = [callback]
+            world.doAt(deadline, self._fire, deadline)
+        else:
+            slot.append(callback)
+
+    def _fire(self, deadline):
+        for callback in self.slots.pop(deadline):
+            callback()
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots.values())
+
+
+class ScheduledEvent(list):
+    """
+    An event in the World's queue.
+
+    This is what World.doAt() and friends return.  It's really just a list
+    of [time, sequence number, method, args, kw] (so the queue can compare
+    them quickly), but you can call .cancel() on it.  Cancelled events stay
+    in the queue as tombstones until they're skipped or compacted away.
+
+    """
+    __slots__ = ()
+
+    @property
+    def time(self):
+        return self[0]
+
+    @property
+    def cancelled(self):
+        return self[2] is None
+
+    def cancel(self):
+        """Keeps the event from running.  Harmless if it already ran."""
+        if self[2] is not None:
+            self[2] = None
+            if world is not None:
+                world.queue.tombstones += 1
+
+
+class HeapEventQueue(object):
+    """
+    The default event queue for the World.
+
+    Events scheduled from the simulation thread go straight onto a plain
+    heapq heap without any locking.  Events scheduled from any other thread
+    (e.g., the remote interface or the interactive console) go into a
+    thread-safe inbox, which is drained into the heap whenever the World
+    asks for the next event.
+
+    """
+    # Compact once there are at least this many cancelled events in the heap
+    # and they make up at least half of it.
+    COMPACT_MIN = 1024
+
+    def __init__(self):
+        self.heap = []
+        self.inbox = deque()
+        self.tombstones = 0  # (Approximate) number of cancelled events
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    def put(self, item):
+        """Adds an event.  Only call this from the simulation thread."""
+        heapq.heappush(self.heap, item)
+
+    def put_external(self, item):
+        """Adds an event from some thread other than the simulation
+        thread."""
+        with self._lock:
+            self.inbox.append(item)
+            self._ready.notify()
+
+    def _drain(self):
+        inbox = self.inbox
+        heap = self.heap
+        while inbox:
+            heapq.heappush(heap, inbox.popleft())
+
+    def compact(self):
+        """Removes cancelled events from the heap."""
+        heap = self.heap
+        heap[:] = [o for o in heap if o[2] is not None]
+        heapq.heapify(heap)
+        self.tombstones = 0
+
+    def empty(self):
+        return not self.heap and not self.inbox
+
+    def __len__(self):
+        return len(self.heap) + len(self.inbox)
+
+    def peek(self):
+        """Returns the next event without removing it (or None)."""
+        if self.inbox:
+            self._drain()
+        heap = self.heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+            if self.tombstones > 0:
+                self.tombstones -= 1
+        return heap[0] if heap else None
+
+    def wait(self, timeout):
+        """
+        Waits up to timeout seconds for an event from another thread.
+
+        Events from the simulation thread itself obviously can't show up
+        while it's waiting, so this only needs to watch the inbox.
+
+        """
+        with self._lock:
+            if not self.inbox:
+                self._ready.wait(timeout)
+
+    def get(self, block=True, timeout=None):
+        """Like Queue.get(), but only the simulation thread may call it."""
+        if self.inbox:
+            self._drain()
+        if (self.tombstones >= self.COMPACT_MIN
+                and self.tombstones * 2 >= len(self.heap)):
+            self.compact()
+        heap = self.heap
+        while True:
+            if not heap and block:
+                block = False  # Only wait once
+                with self._lock:
+                    if not self.inbox:
+                        self._ready.wait(timeout)
+                self._drain()
+            if not heap:
+                raise Queue.Empty()
+            o = heapq.heappop(heap)
+            if o[2] is not None:
+                return o
+            if self.tombstones > 0:
+                self.tombstones -= 1
+
+    def get_batch(self, block=True, timeout=None):
+        """Like get(), but returns a list of all events which share the
+        earliest time (in order)."""
+        o = self.get(block, timeout)
+        t = o[0]
+        batch = [o]
+        heap = self.heap
+        while heap and heap[0][0] == t:
+            o = heapq.heappop(heap)
+            if o[2] is not None:
+                batch.append(o)
+            elif self.tombstones > 0:
+                self.tombstones -= 1
+        return batch
+
+
+class LockedEventQueue(Queue.PriorityQueue):
+    """
+    The original event queue, where every operation takes a lock.
+
+    Mostly useful for comparison with HeapEventQueue.
+
+    """
+    COMPACT_MIN = HeapEventQueue.COMPACT_MIN
+
+    def _init(self, maxsize):
+        Queue.PriorityQueue._init(self, maxsize)
+        self.tombstones = 0
+        self._puts = 0  # For wait()
+        self._seen = 0  # Value of _puts at the last peek()
+
+    def _put(self, item):
+        Queue.PriorityQueue._put(self, item)
+        self._puts += 1
+
+    def peek(self):
+        with self.mutex:
+            self._seen = self._puts
+            q = self.queue
+            while q and q[0][2] is None:
+                heapq.heappop(q)
+                if self.tombstones > 0:
+                    self.tombstones -= 1
+            return q[0] if q else None
+
+    def wait(self, timeout):
+        with self.not_empty:
+            if self._puts == self._seen:
+                self.not_empty.wait(timeout)
+
+    def put_external(self, item):
+        self.put(item)
+
+    def compact(self):
+        with self.mutex:
+            self.queue[:] = [o for o in self.queue if o[2] is not None]
+            heapq.heapify(self.queue)
+            self.tombstones = 0
+
+    def get(self, block=True, timeout=None):
+        if (self.tombstones >= self.COMPACT_MIN
+                and self.tombstones * 2 >= self.qsize()):
+            self.compact()
+        while True:
+            o = Queue.PriorityQueue.get(self, block, timeout)
+            if o[2] is not None:
+                return o
+            if self.tombstones > 0:
+                self.tombstones -= 1
+
+    def get_batch(self, block=True, timeout=None):
+        o = self.get(block, timeout)
+        t = o[0]
+        batch = [o]
+        with self.mutex:
+            while self.queue and self.queue[0][0] == t:
+                batch.append(self._get())
+        return batch
+
+
+event_queue_types = {
+    'heap': HeapEventQueue,
+    'locked': LockedEventQueue,
+}
+
+
 world = None
 events = None
 
@@ -184,9 +466,16 @@ class World(object):
         global world
         world = self
 
-        self.queue = Queue.PriorityQueue()
+        queue_type = sim.config.event_queue
+        if not isinstance(queue_type, type):
+            if queue_type not in event_queue_types:
+                raise RuntimeError("No such event queue type '%s'" %
+                                   (queue_type, ))
+            queue_type = event_queue_types[queue_type]
+        self.queue = queue_type()
         self._thread = None
-        self._count = 0
+        self._thread_ident = None  # Identity of the simulation thread
+        self._count = itertools.count()
         self.ended = False
 
         # When the world isn't running, items are put in the prelist.
@@ -210,6 +499,14 @@ class World(object):
         self.trace = False
         self._running = True
 
+        # Things that may add events from other threads (see add_producer())
+        self._producers = set()
+
+        self.timer_wheel = None
+        if sim.config.timer_wheel:
+            self.timer_wheel = TimerWheel(
+                float(sim.config.timer_wheel_resolution))
+
         self.virtual_time = False
 
         import sim.api as api
@@ -243,6 +540,13 @@ class World(object):
             import sim.comm as interface
             should_sleep = False
         events = interface.interface()
+
+        self.seed = sim.config.seed
+        if self.seed is None:
+            self.seed = random.SystemRandom().randrange(2**32)
+        simlog.debug("Random seed is %s", self.seed)
+        self.packet_random = self.rng("packets")
+
         if should_sleep:
             # Sleep a sec to allow remote to possibly connect
             time.sleep(1)
@@ -261,6 +565,38 @@ class World(object):
     def stop(self):
         self._running = False
 
+    def rng(self, key):
+        """
+        Returns a random.Random for the given key (e.g., an entity name).
+
+        The stream only depends on the World's seed and the key, so things
+        that draw from their own stream aren't affected by how many numbers
+        anything else draws.
+
+        """
+        return random.Random("%s/%s" % (self.seed, key))
+
+    @property
+    def packet_colors(self):
+        """Whether new packets should get random colors."""
+        colors = sim.config.packet_colors
+        if colors is None:
+            return events.has_viewers
+        return colors
+
+    def add_producer(self, producer):
+        """
+        Registers something which may schedule events from another thread.
+
+        While any producers are registered, a virtual time World with an
+        empty queue will wait around for new events rather than ending.
+
+        """
+        self._producers.add(producer)
+
+    def remove_producer(self, producer):
+        self._producers.discard(producer)
+
     def _get_time_real(self):
         # if self._start_time is None:
         return time.time()
@@ -294,11 +630,15 @@ class World(object):
 
     def _real_doLater(_self, _seconds, _method, *_args, **_kw):
         t = _self.time + _seconds
-        _self._real_doAt(t, _method, *_args, **_kw)
+        return _self._real_doAt(t, _method, *_args, **_kw)
 
     def _real_doAt(_self, _t, _method, *_args, **_kw):
-        _self.queue.put((_t, _self._count, _method, _args, _kw))
-        _self._count += 1
+        o = ScheduledEvent((_t, next(_self._count), _method, _args, _kw))
+        if _get_ident() == _self._thread_ident:
+            _self.queue.put(o)
+        else:
+            _self.queue.put_external(o)
+        return o
 
     @property
     def info(self):
@@ -313,36 +653,63 @@ class World(object):
     def info(self, text):
         self._set_info(text)
 
+    def _prepare(self):
+        now = self.time
+        for o in self._prelist:
+            if o[2] is None:
+                continue  # Cancelled
+            o[0] += now
+            self.queue.put_external(o)
+        self._prelist = []
+
     def start(self, threaded=True):
         assert self._thread is None
         simlog.info("Starting simulation.")
 
-        for a, b, c, d in self._prelist:
-            self._real_doLater(a, b, *c, **d)
-        self._prelist = []
+        self._prepare()
 
         if threaded:
-            self._thread = threading.Thread(target=self.run)
+            self._thread = threading.Thread(target=self._run_thread)
             self._thread.daemon = True
             self._thread.start()
         else:
             self._thread = threading.current_thread()
-            self.run()
+            self._run_thread()
+
+    def _run_thread(self):
+        self._thread_ident = _get_ident()
+        self.run()
 
     def do(self, _method, *args, **kw):
-        self.doLater(0, _method, *args, **kw)
+        return self.doLater(0, _method, *args, **kw)
 
     def doLater(_self, _seconds, _method, *_args, **_kw):
+        """
+        Schedules _method to be called in _seconds seconds.
+
+        Returns a ScheduledEvent, which can be cancelled.
+
+        """
         if _self._thread is not None:
-            _self._real_doLater(_seconds, _method, *_args, **_kw)
-        else:
-            _self._prelist.append((_seconds, _method, _args, _kw))
+            return _self._real_doLater(_seconds, _method, *_args, **_kw)
+        return _self._pre_doLater(_seconds, _method, _args, _kw)
 
     def doAt(_self, _time, _method, *_args, **_kw):
+        """
+        Schedules _method to be called at time _time.
+
+        Returns a ScheduledEvent, which can be cancelled.
+
+        """
         if _self._thread is not None:
-            _self._real_doAt(_time, _method, *_args, **_kw)
-        else:
-            _self._prelist.append((_time - _self.time, _method, _args, _kw))
+            return _self._real_doAt(_time, _method, *_args, **_kw)
+        return _self._pre_doLater(_time - _self.time, _method, _args, _kw)
+
+    def _pre_doLater(self, seconds, method, args, kw):
+        # Time is relative until the world is started
+        o = ScheduledEvent((seconds, next(self._count), method, args, kw))
+        self._prelist.append(o)
+        return o
 
     def sleep(self, seconds):
         """
@@ -363,53 +730,21 @@ class World(object):
         event.wait()
 
     def _run_real(self):
-        timeout = None
-        waiting = Queue.PriorityQueue()
+        queue = self.queue
 
         try:
             while self._running:
-                try:
-                    t = self.time
-                    while not waiting.empty():
-                        o = waiting.get()
-                        if o[0] <= t:
-                            self.queue.put(o)
-                            timeout = None
-                        else:
-                            waiting.put(o)
-                            o = waiting.get()
-                            waiting.put(o)
-                            timeout = o[0] - t
-                            break
-                    #print("World waiting for",timeout)
-
-                    o = self.queue.get(True, 5 if timeout is None else timeout)
-                except Exception:
-                    # print("empty")
+                o = queue.peek()
+                if o is None:
+                    queue.wait(5)
                     continue
-
-                t = self.time
-                if o[0] > t:
-                    # Hasn't expired yet...
-                    # print("recycle")
-                    waiting.put(o)
-                    o = waiting.get()
-                    waiting.put(o)
-                    timeout = o[0] - t
+                delay = o[0] - self.time
+                if delay > 0:
+                    # Not due yet.  Sleep until it is, or until some other
+                    # thread adds an event (which might be due sooner).
+                    queue.wait(delay)
                     continue
-                # Expired
-                timeout = None
-                if self.trace:
-                    if hasattr(o[2], "__self__"):
-                        print(
-                            o[2].__self__.__class__.__name__ + "." +
-                            o[2].__func__.__name__,
-                            end='')
-                    else:
-                        print(o[2], end='')
-                    print(o[3], o[4] if len(o[4]) else '')
-                o[2](*o[3], **o[4])
-                self._post_hook()
+                self._dispatch(queue.get_batch(False))
         except KeyboardInterrupt:
             pass
         except SystemExit:
@@ -430,10 +765,16 @@ class World(object):
         try:
             while self._running:
                 try:
-                    o = self.queue.get(True, 1)
+                    # Only bother waiting if someone might add more events
+                    # (or if we were asked to wait anyway)
+                    block = bool(self._producers) or not sim.config.idle_exit
+                    batch = self.queue.get_batch(block, 1)
                     timeout = max_timeout
                     warned = False
-                except Exception:
+                except Queue.Empty:
+                    if not self._producers and sim.config.idle_exit:
+                        simlog.debug("No more events.  Simulation over.")
+                        break
                     timeout -= 1
                     if timeout < 0:
                         simlog.debug("No more events.  Simulation over.")
@@ -445,18 +786,8 @@ class World(object):
                 except Exception:
                     break
 
-                self._time = o[0]
-                if self.trace:
-                    if hasattr(o[2], "__self__"):
-                        print(
-                            o[2].__self__.__class__.__name__ + "." +
-                            o[2].__func__.__name__,
-                            end='')
-                    else:
-                        print(o[2], end='')
-                    print(o[3], o[4] if len(o[4]) else '')
-                o[2](*o[3], **o[4])
-                self._post_hook()
+                self._time = batch[0][0]
+                self._dispatch(batch)
         except KeyboardInterrupt:
             pass
         except SystemExit:
@@ -468,6 +799,92 @@ class World(object):
             simlog.debug("Simulation ended")
             self.ended = True
 
+    def run_until(self, t):
+        """
+        Runs events in virtual time until the clock reaches time t.
+
+        Events run in the calling thread, and the clock is left at t.  This
+        is meant for driving the simulator from a script or test instead of
+        using start().  Returns the number of events which were run.
+
+        """
+        return self._run_events(until=t)
+
+    def run_for(self, n_events):
+        """
+        Runs the next n_events events in virtual time.
+
+        Like run_until(), but stops after a number of events.  Returns the
+        number of events which were actually run (which may be fewer if
+        the queue runs dry).
+
+        """
+        return self._run_events(max_events=n_events)
+
+    def _start_inline(self):
+        """Makes the calling thread the simulation thread without running
+        the usual loop."""
+        assert self.virtual_time, "Only works in virtual time"
+        if self._thread is None:
+            self._prepare()
+            self._thread = threading.current_thread()
+        assert self._thread is threading.current_thread()
+        self._thread_ident = _get_ident()
+
+    def _run_events(self, until=None, max_events=None, inclusive=True):
+        self._start_inline()
+
+        n = 0
+        queue = self.queue
+        while max_events is None or n < max_events:
+            o = queue.peek()
+            if o is None:
+                break
+            if until is not None:
+                if o[0] > until or (o[0] == until and not inclusive):
+                    break
+            if max_events is None:
+                batch = queue.get_batch(False)
+            else:
+                batch = [queue.get(False)]
+            self._time = o[0]
+            self._dispatch(batch)
+            n += len(batch)
+        if until is not None and self._time < until:
+            self._time = until
+        return n
+
+    def _dispatch(self, batch):
+        """
+        Runs a batch of events which all have the same time.
+
+        The clock isn't touched and _post_hook() is only called once for
+        the whole batch.  An event in the batch may have been cancelled by
+        an earlier one, so check for that.
+
+        """
+        if self.trace:
+            for o in batch:
+                if o[2] is not None:
+                    self._trace_event(o)
+                    o[2](*o[3], **o[4])
+        else:
+            for o in batch:
+                method = o[2]
+                if method is not None:
+                    method(*o[3], **o[4])
+        self._post_hook()
+
+    def _trace_event(self, o):
+        if hasattr(o[2], "__self__"):
+            print(
+                o[2].__self__.__class__.__name__ + "." +
+                o[2].__func__.__name__,
+                end='')
+        else:
+            print(o[2], end='')
+        print(o[3], o[4] if len(o[4]) else '')
+
     def _post_hook(self):
         pass
 
@@ -497,6 +914,50 @@ class TopoNode(object):
         self.ports = [None] * numPorts
         self.growPorts = growPorts
         self.entity = None
+        # Sorted numbers of ports which have a cable (for flooding)
+        self._live_ports = []
+        # Min-heap of possibly-free port numbers (stale entries get skipped)
+        self._free_ports = list(range(numPorts))
+        # Neighbor TopoNode -> sorted numbers of our ports with cables to it
+        self._neighbors = {}
+
+    def _set_port(self, index, cable):
+        """Puts a cable (or None) on a port.  Always use this rather than
+        assigning to .ports directly."""
+        old = self.ports[index]
+        if old is cable:
+            return
+        self.ports[index] = cable
+        if old is not None:
+            ports = self._neighbors[old.dst]
+            del ports[bisect.bisect_left(ports, index)]
+            if not ports:
+                del self._neighbors[old.dst]
+            if cable is None:
+                del self._live_ports[bisect.bisect_left(self._live_ports,
+                                                        index)]
+                heapq.heappush(self._free_ports, index)
+        elif cable is not None:
+            bisect.insort(self._live_ports, index)
+        if cable is not None:
+            bisect.insort(self._neighbors.setdefault(cable.dst, []), index)
+
+    def _free_port(self):
+        """Returns the lowest numbered port without a cable, or None."""
+        free = self._free_ports
+        while free:
+            if self.ports[free[0]] is None:
+                return free[0]
+            heapq.heappop(free)
+        return None
+
+    def _add_port(self):
+        """Adds a new empty port and returns its number."""
+        assert self.growPorts
+        self.ports.append(None)
+        index = len(self.ports) - 1
+        heapq.heappush(self._free_ports, index)
+        return index
 
     def linkTo(self, topoEntity, cable=None, fillEmpty=True, latency=None):
         """
@@ -539,11 +1000,11 @@ class TopoNode(object):
         topoEntity = topoOf(topoEntity)
 
         def getPort(entity):
-            if not fillEmpty or entity.ports.count(None) == 0:
+            port = entity._free_port() if fillEmpty else None
+            if port is None:
                 assert self.growPorts
-                entity.ports.append(None)
-                return len(entity.ports) - 1
-            return entity.ports.index(None)
+                port = entity._add_port()
+            return port
 
         assert topoEntity is not self
 
@@ -555,13 +1016,13 @@ class TopoNode(object):
 
         if cable[0] is not None:
             c = fixCableEnd(cable[0], self, localPort, topoEntity, remotePort)
-            self.ports[localPort] = c
+            self._set_port(localPort, c)
 
             world.do(_catch, self.entity.handle_link_up, localPort, c.latency)
 
         if cable[1] is not None:
             c = fixCableEnd(cable[1], topoEntity, remotePort, self, localPort)
-            topoEntity.ports[remotePort] = c
+            topoEntity._set_port(remotePort, c)
 
             world.do(_catch, topoEntity.entity.handle_link_up, remotePort,
                      c.latency)
@@ -584,25 +1045,18 @@ class TopoNode(object):
             _catch(other.entity.handle_link_down, otherPort)
             _catch(self.entity.handle_link_down, index)
 
-            other.ports[otherPort] = None
-            self.ports[index] = None
+            if other.ports[otherPort] is not None:
+                other._set_port(otherPort, None)
+            self._set_port(index, None)
 
-        remove = [index for index, value in enumerate(self.ports)
-                  if value is not None and value.dst is topoEntity]
-        for index in remove:
+        for index in list(self._neighbors.get(topoEntity, ())):
             if right_now:
                 world.do(goDown, index)
             else:
                 world.doLater(0, goDown, index)
 
     def isConnectedTo(self, other):
-        other = topoOf(other)
-        for p in self.ports:
-            if p is None:
-                continue
-            if p.dst is other:
-                return True
-        return False
+        return topoOf(other) in self._neighbors
 
     def disconnect(self):
         for p in (port for port in self.ports if port):
@@ -626,6 +1080,18 @@ class TopoNode(object):
         if (packet.src is None):  # or (packet.src is NullAddress):
             packet.src = self.entity
 
+        if flood:
+            # Only look at ports that actually have cables
+            cables = self.ports
+            if isinstance(port, (list, set, tuple)):
+                exclude = set(port)
+                ports = [p for p in self._live_ports if p not in exclude]
+            else:
+                ports = [p for p in self._live_ports if p != port]
+            for remote in ports:
+                cables[remote].transfer(_duplicate_packet(packet))
+            return
+
         if not isinstance(port, (list, set, tuple)):
             ports = [port]
         elif port is None:
@@ -633,9 +1099,6 @@ class TopoNode(object):
         else:
             ports = list(port)
 
-        if flood:
-            ports = [p for p in range(0, len(self.ports)) if p not in ports]
-
         for remote in ports:
             if remote >= 0 and remote < len(self.ports):
                 remote = self.ports[remote]
@@ -644,12 +1107,55 @@ class TopoNode(object):
                     remote.transfer(p)
 
 
+_packet_slots = {}  # Packet type -> names of all its slots
+
+# These are copy-on-write (see api._CopyOnWrite), so duplicates share them
+_shared_packet_slots = ('_trace', '_outer_color', '_inner_color')
+
+
+def _get_packet_slots(cls):
+    """Returns the names of the slots _duplicate_packet() should copy."""
+    slots = _packet_slots.get(cls)
+    if slots is None:
+        slots = []
+        for c in reversed(cls.__mro__):
+            names = c.__dict__.get('__slots__', ())
+            if isinstance(names, str):
+                names = (names, )
+            for name in names:
+                if name in ('__dict__', '__weakref__', '_shared'):
+                    continue
+                if name in _shared_packet_slots:
+                    continue
+                slots.append(name)
+        slots = _packet_slots[cls] = tuple(slots)
+    return slots
+
+
 def _duplicate_packet(p):
-    n = type(p).__new__(type(p))
-    for k, v in vars(p).items():
-        if isinstance(v, (dict, tuple, list, set)):
-            setattr(n, k, copy.copy(v))
-        else:
+    cls = type(p)
+    n = cls.__new__(cls)
+    for k in _get_packet_slots(cls):
+        try:
+            v = getattr(p, k)
+        except AttributeError:
+            continue  # Never set
+        if type(v) is list:
+            v = v[:]
+        elif isinstance(v, (dict, tuple, list, set)):
+            v = copy.copy(v)
+        setattr(n, k, v)
+    # Share the copy-on-write fields; whichever packet touches one of them
+    # first will get its own copy.
+    n._trace = p._trace
+    n._outer_color = p._outer_color
+    n._inner_color = p._inner_color
+    n._shared = p._shared = p._SHARED_ALL
+    d = getattr(p, '__dict__', None)
+    if d:
+        for k, v in d.items():
+            if isinstance(v, (dict, tuple, list, set)):
+                v = copy.copy(v)
             setattr(n, k, v)
     return n
 
@@ -754,6 +1260,26 @@ def CreateEntity(_name, _kind, *args, **kw):
     return e
 
 
+def fresh_world():
+    """
+    Replaces the World with a new, empty one and returns it.
+
+    Every existing entity is removed first.  The new World runs in virtual
+    time without a remote interface or console, so it's meant to be driven
+    with run_until() from a script or test (or sim.pdes).  Like any World,
+    it takes its seed from sim.config.seed.
+
+    """
+    for e in list(topo.keys()):
+        e.remove()
+    topo.clear()
+    sim.config.remote_interface = None
+    sim.config.interactive = False
+    w = World()
+    w.virtual_time = True
+    return w
+
+
 def topoOf(entity):
     """
     Get TopoNode that contains entity.
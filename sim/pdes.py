@@ -0,0 +1,356 @@
+"""
+Conservative parallel simulation across processes.
+
+This splits a topology across several worker processes, each of which runs
+its own World.  Packets which cross from one worker's part of the topology
+to another's are shipped between the workers.  The workers run in lockstep
+windows as long as the smallest delay of any cable that crosses between
+them (the "lookahead"), so nothing can ever arrive in a window that a
+worker has already finished.
+
+Usage looks like:
+
+  import sim.pdes
+  def build ():
+    topos.rand.launch(switches=1000, links=3000, seed=1)
+  tables = sim.pdes.run(build, workers=8, until=300,
+                        collect=lambda e: getattr(e, "routing_table", None))
+
+Each worker forks from the calling process and calls build() in a fresh
+World, so build() must create the very same topology every time (use
+seeds!) and shouldn't depend on entities existing already.  Each worker
+then switches off the entities that belong to other workers.
+
+Some limitations:
+ * The topology must not change once it is built.
+ * Cables which cross between workers must implement min_delay() and
+   _enqueue() (DumbCable, BasicCable and their subclasses do), and their
+   queue_size is not enforced on the sending side.
+ * Packets which cross between workers get pickled, so their classes must
+   be importable.  Entities inside them are sent by name.
+ * Code which isn't owned by any entity (e.g., a tasklet in a test) runs
+   in every worker, and only has an effect on the local entities.  So
+   global checks like "h2 got 3 pings" don't work.
+ * Runs are repeatable, but when several events happen at the very same
+   time, they may run in a different order than in a single process.  The
+   converged results (e.g., distances in routing tables) will match, but
+   which of two equal-cost routes gets picked may not.
+ * Requires fork (i.e., not Windows).
+
+"""
+
+from __future__ import print_function
+import io
+import itertools
+import pickle
+import traceback
+import multiprocessing
+
+import sim
+import sim.api as api
+import sim.core as core
+
+
+def partition(nodes, parts):
+    """
+    Assigns each TopoNode to one of parts partitions.
+
+    Nodes are put in breadth-first order (starting from the lowest name and
+    visiting neighbors in name order) and split into contiguous chunks, so
+    neighbors tend to land together.  Returns {name: partition number}.
+    The result only depends on names and links, so every worker computes
+    the same thing.
+
+    """
+    by_name = dict((n.entity.name, n) for n in nodes)
+    order = []
+    seen = set()
+    for start in sorted(by_name):
+        if start in seen:
+            continue
+        seen.add(start)
+        frontier = [start]
+        while frontier:
+            order.extend(frontier)
+            next_frontier = []
+            for name in frontier:
+                neighbors = set(p.dst.entity.name for p in by_name[name].ports
+                                if p is not None)
+                for other in sorted(neighbors):
+                    if other not in seen and other in by_name:
+                        seen.add(other)
+                        next_frontier.append(other)
+            frontier = next_frontier
+
+    parts = max(1, min(int(parts), len(order)))
+    assignment = {}
+    for i, name in enumerate(order):
+        assignment[name] = i * parts // len(order)
+    return assignment
+
+
+def lookahead(nodes, assignment):
+    """
+    Returns the smallest min_delay() of any cable crossing partitions.
+
+    That's infinite if no cables cross.
+
+    """
+    best = float("inf")
+    for node in nodes:
+        for cable in _crossing_cables(node, assignment):
+            min_delay = getattr(cable, "min_delay", None)
+            if min_delay is None:
+                raise RuntimeError("%s can't cross between partitions" %
+                                   (type(cable).__name__, ))
+            best = min(best, min_delay())
+    if best <= 0:
+        raise RuntimeError("Cables crossing partitions need a positive delay")
+    return best
+
+
+def _crossing_cables(node, assignment):
+    here = assignment[node.entity.name]
+    for cable in node.ports:
+        if cable is None:
+            continue
+        if assignment.get(cable.dst.entity.name, here) != here:
+            yield cable
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles Entities by name."""
+
+    def persistent_id(self, obj):
+        if isinstance(obj, api.Entity):
+            return obj.name
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """Turns names back into Entities (or leaves them as names if
+    entities is None)."""
+
+    def __init__(self, f, entities):
+        pickle.Unpickler.__init__(self, f)
+        self.entities = entities
+
+    def persistent_load(self, name):
+        if self.entities is None:
+            return name
+        return self.entities[name]
+
+
+def _dumps(obj):
+    f = io.BytesIO()
+    _Pickler(f, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+
+def _loads(data, entities=None):
+    return _Unpickler(io.BytesIO(data), entities).load()
+
+
+def _nothing(*args, **kw):
+    pass
+
+
+def _owner(method, args):
+    """Figures out which Entity (if any) a scheduled event belongs to."""
+    if method is core._catch and args:
+        method = args[0]
+    obj = getattr(method, "__self__", None)
+    if isinstance(obj, core.Timer):
+        obj = getattr(obj.func, "__self__", None)
+    if isinstance(obj, api.Entity):
+        return obj
+    return None
+
+
+class _Worker(object):
+    def __init__(self, conn, index, workers, build, collect):
+        self.conn = conn
+        self.index = index
+        self.collect = collect
+
+        sim.config.timer_wheel = False  # Its events have no owner
+        sim.config.packet_colors = False
+        w = core.fresh_world()
+        self.world = w
+
+        build()
+
+        self.nodes = sorted(core.topo.values(), key=lambda n: n.entity.name)
+        self.entities = dict((n.entity.name, n.entity) for n in self.nodes)
+        self.assignment = partition(self.nodes, workers)
+        self.lookahead = lookahead(self.nodes, self.assignment)
+
+        self.local = set(name for name, part in self.assignment.items()
+                         if part == index)
+        for name, e in self.entities.items():
+            if name not in self.local:
+                self._disable(e)
+
+        # Forget about events that belong to other workers' entities
+        for o in w._prelist:
+            if o[2] is None:
+                continue
+            owner = _owner(o[2], o[3])
+            if owner is None or owner.name in self.local:
+                continue
+            timer = getattr(o[2], "__self__", None)
+            if isinstance(timer, core.Timer):
+                timer.cancel()
+            else:
+                o.cancel()
+
+        self.outbox = dict((i, []) for i in range(workers) if i != index)
+        for node in self.nodes:
+            if node.entity.name not in self.local:
+                continue
+            for cable in _crossing_cables(node, self.assignment):
+                dest = self.assignment[cable.dst.entity.name]
+                cable._enqueue = self._make_export(cable, dest)
+
+        w._start_inline()
+
+    def _disable(self, e):
+        for m in ["send", "handle_rx", "handle_link_up", "handle_link_down"]:
+            setattr(e, m, _nothing)
+
+    def _make_export(self, cable, dest):
+        outbox = self.outbox[dest]
+        src = cable.srcEnt.name
+        port = cable.srcPort
+        seq = itertools.count()
+
+        def export(t, packet):
+            outbox.append((t, src, port, next(seq), packet))
+
+        return export
+
+    def next_time(self):
+        o = self.world.queue.peek()
+        return float("inf") if o is None else o[0]
+
+    def run_window(self, end):
+        self.world._run_events(until=end, inclusive=False)
+        out = {}
+        for dest, packets in self.outbox.items():
+            if packets:
+                out[dest] = _dumps(packets)
+                del packets[:]
+        return out
+
+    def receive(self, batches):
+        incoming = []
+        for data in batches:
+            incoming.extend(_loads(data, self.entities))
+        # The same order no matter how the batches showed up
+        incoming.sort(key=lambda m: m[:4])
+        for t, src, port, seq, packet in incoming:
+            cable = core.topoOf(self.entities[src]).ports[port]
+            cable._enqueue(t, packet)
+
+    def results(self):
+        r = {}
+        if self.collect is not None:
+            for name in sorted(self.local):
+                r[name] = self.collect(self.entities[name])
+        return _dumps(r)
+
+    def serve(self):
+        self.conn.send(("ready", self.lookahead, self.next_time()))
+        while True:
+            msg = self.conn.recv()
+            if msg[0] == "run":
+                self.conn.send(("out", self.run_window(msg[1])))
+            elif msg[0] == "rx":
+                self.receive(msg[1])
+                self.conn.send(("next", self.next_time()))
+            elif msg[0] == "finish":
+                self.conn.send(("results", self.results()))
+                return
+
+
+def _worker_main(conn, index, workers, build, collect):
+    try:
+        _Worker(conn, index, workers, build, collect).serve()
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def _recv(conn):
+    msg = conn.recv()
+    if msg[0] == "error":
+        raise RuntimeError("Parallel simulation worker failed:\n" + msg[1])
+    return msg
+
+
+def run(build, workers=2, until=60, collect=None, seed=None):
+    """
+    Runs a simulation split across worker processes.
+
+    build() is called in each worker to create the topology.  The
+    simulation runs for until seconds of virtual time, and then collect()
+    is called on each entity (in the worker that owns it).  Returns a dict
+    of entity name -> whatever collect() returned, where any entities in
+    the results have been replaced by their names.
+
+    All the workers' Worlds use the same seed, which defaults to the seed
+    of the current World (if there is one).
+
+    """
+    if seed is None:
+        seed = core.world.seed if core.world is not None else 0
+    sim.config.seed = seed
+
+    if hasattr(multiprocessing, "get_context"):
+        ctx = multiprocessing.get_context("fork")
+    else:
+        ctx = multiprocessing
+
+    conns = []
+    procs = []
+    try:
+        for i in range(workers):
+            parent, child = ctx.Pipe()
+            p = ctx.Process(target=_worker_main,
+                            args=(child, i, workers, build, collect))
+            p.daemon = True
+            p.start()
+            child.close()
+            conns.append(parent)
+            procs.append(p)
+
+        ready = [_recv(c) for c in conns]
+        step = min(m[1] for m in ready)
+        now = min(m[2] for m in ready)
+        while now < until:
+            end = min(now + step, until)
+            for c in conns:
+                c.send(("run", end))
+            inbound = [[] for _ in conns]
+            for c in conns:
+                for dest, data in _recv(c)[1].items():
+                    inbound[dest].append(data)
+            for c, batches in zip(conns, inbound):
+                c.send(("rx", batches))
+            # Skip ahead over stretches where nothing happens
+            now = max(end, min(_recv(c)[1] for c in conns))
+
+        results = {}
+        for c in conns:
+            c.send(("finish", ))
+        for c in conns:
+            results.update(_loads(_recv(c)[1]))
+        return results
+    finally:
+        for c in conns:
+            c.close()
+        for p in procs:
+            p.join(5)
+            if p.is_alive():
+                p.terminate()
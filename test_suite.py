@@ -24,6 +24,11 @@ def main():
     t.test('dv_router', 'tests.test_simple', extra_args=['--poison-mode'])
     t.test('dv_router', 'tests.test_failure')
     t.test('dv_router', 'tests.test_failure', extra_args=['--poison-mode'])
+    t.test('dv_router', 'tests.test_failure', extra_args=['--route-vectors'])
+    t.test('dv_router', 'tests.test_failure',
+           extra_args=['--poison-mode', '--route-vectors'])
+    t.test('dv_router', 'tests.test_failure',
+           extra_args=['--triggered-updates'])
     t.test('dv_router', 'tests.test_initialize_neighbor')
     t.test('dv_router', 'tests.test_initialize_neighbor', extra_args=['--poison-mode'])
     t.test('dv_router', 'tests.test_no_hairpin')
@@ -32,10 +37,28 @@ def main():
     t.test('dv_router', 'tests.test_link_weights', extra_args=['--poison-mode'])
     t.test('dv_router', 'tests.test_expire_routes')
     t.test('dv_router', 'tests.test_expire_routes', extra_args=['--poison-mode'])
+    t.test('dv_router', 'tests.test_expire_routes',
+           extra_args=['--poison-mode', '--compact-table'])
+    t.test('dv_router', 'tests.test_expire_routes',
+           extra_args=['--timer-wheel'])
+    t.test('dv_router', 'tests.test_expire_routes',
+           extra_args=['--poison-mode', '--timer-wheel'])
     t.test(
         'dv_router',
         'tests.test_route_poisoning',
         extra_args=['--poison-mode'])
+    t.test(
+        'dv_router',
+        'tests.test_route_poisoning',
+        extra_args=['--poison-mode', '--route-vectors'])
+    t.test(
+        'dv_router',
+        'tests.test_route_poisoning',
+        extra_args=['--poison-mode', '--triggered-updates'])
+    t.test(
+        'dv_router',
+        'tests.test_route_poisoning',
+        extra_args=['--poison-mode', '--timer-wheel'])
     t.test('dv_router','tests.test_simple_2_routers')
     t.test('dv_router', 'tests.test_simple_2_routers', extra_args=['--poison-mode'])
     t.test('dv_router','tests.test_failure_3_routers')
@@ -55,6 +78,13 @@ def main():
     t.test('dv_router', 'tests.test_basics_intensely', extra_args=['--poison-mode'])
     t.test('dv_router','tests.host_many_routers')
     t.test('dv_router', 'tests.host_many_routers', extra_args=['--poison-mode'])
+    t.test('dv_router', 'tests.test_parallel')
+    t.test('dv_router', 'tests.test_bandwidth_cable')
+    t.test('dv_router', 'tests.test_bursty_cable')
+    t.test('dv_router', 'tests.test_routing_table')
+    t.test('dv_router', 'tests.test_triggered_refresh')
+    t.test('dv_router', 'tests.test_triggered_refresh',
+           extra_args=['--poison-mode'])
 
 
     # Add your own tests here.
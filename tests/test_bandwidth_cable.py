@@ -0,0 +1,69 @@
+"""
+Tests that BandwidthCable delays and drops packets by size.
+
+Connects h1 to h2 with a 8000 bit/s BandwidthCable (1 byte per
+millisecond) whose buffer holds 300 bytes of 100 byte pings.  h1 sends
+five pings all at once.  The test passes if the first three arrive one
+serialization delay apart, the last two are dropped, and the cable's
+counters agree (including h1's 64 byte discovery packet).  Also checks
+that a RouteVectorPacket's size depends on how many routes it holds.
+
+"""
+
+import sim
+import sim.api as api
+import sim.basics as basics
+import sys
+
+from sim.cable import BandwidthCable
+
+
+class ReceiverHost(basics.BasicHost):
+    def __init__(self):
+        self.arrivals = []
+
+    def handle_rx(self, packet, port):
+        if isinstance(packet, basics.Ping):
+            self.arrivals.append(api.current_time())
+
+
+def launch():
+    h1 = basics.BasicHost.create('h1')
+    h2 = ReceiverHost.create('h2')
+    cable = BandwidthCable(latency=1, rate=8000, buffer=300)
+    h1.linkTo(h2, cable=(cable, None))
+
+    def test_tasklet():
+        yield 1
+
+        start = api.current_time()
+        for _ in range(5):
+            h1.ping(h2)
+
+        yield 5
+
+        expected = [start + 0.1 * (i + 1) + 1 for i in range(3)]
+        good = True
+        if len(h2.arrivals) != 3:
+            api.userlog.error("Expected 3 pings but got %s",
+                              len(h2.arrivals))
+            good = False
+        elif any(abs(a - b) > 1e-9 for a, b in zip(h2.arrivals, expected)):
+            api.userlog.error("Pings arrived at %s instead of %s",
+                              h2.arrivals, expected)
+            good = False
+        if cable.dropped_packets != 2 or cable.tx_bytes != 364:
+            api.userlog.error("Cable counted %s drops and %s bytes",
+                              cable.dropped_packets, cable.tx_bytes)
+            good = False
+        vector = basics.RouteVectorPacket([(h1, 1), (h2, 2), (h1, 3)])
+        if cable.packet_size(vector) != 48 + 3 * 16:
+            api.userlog.error("A 3 route vector is %s bytes",
+                              cable.packet_size(vector))
+            good = False
+
+        if good:
+            api.userlog.debug("Test passed successfully!")
+        sys.exit(0 if good else 1)
+
+    api.run_tasklet(test_tasklet)
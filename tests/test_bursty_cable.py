@@ -0,0 +1,85 @@
+"""
+Tests that BurstyCable drops everything during outages, repeatably.
+
+Connects h1 to h2 with a BurstyCable which has an outage from 5 to 8
+seconds and bursty losses the rest of the time, and has h1 send a
+numbered ping every quarter second.  This is done twice, each time in a
+fresh World with the same fixed seed.  The test passes if every ping sent
+during the outage is dropped, some others are dropped too, and both runs
+lose exactly the same pings.
+
+"""
+
+import sim
+import sim.api as api
+import sim.basics as basics
+import sim.core as core
+import sys
+
+from sim.cable import BurstyCable
+
+
+OUTAGE = (5, 3)  # Start, duration
+SEED = 7
+
+
+class ReceiverHost(basics.BasicHost):
+    def __init__(self):
+        self.received = set()
+
+    def handle_rx(self, packet, port):
+        if isinstance(packet, basics.Ping):
+            self.received.add(packet.data)
+
+
+def run_once():
+    """Sends pings across a BurstyCable in a fresh World.  Returns a dict
+    from each ping's send time to whether it was lost."""
+    w = core.fresh_world()
+    h1 = basics.BasicHost.create('h1')
+    h2 = ReceiverHost.create('h2')
+    cable = BurstyCable(latency=0.1, drop=0.05, bad_drop=0.8, to_bad=0.1,
+                        to_good=0.3, outages=[OUTAGE])
+    h1.linkTo(h2, cable=(cable, None))
+
+    sent = {}
+    for i in range(4, 100):
+        t = i * 0.25
+        w.run_until(t)
+        h1.ping(h2, data=i)
+        sent[i] = t
+    w.run_until(30)
+
+    return dict((t, i not in h2.received) for i, t in sent.items())
+
+
+def launch():
+    old_seed = sim.config.seed
+    sim.config.seed = SEED
+    try:
+        first = run_once()
+        second = run_once()
+    finally:
+        sim.config.seed = old_seed
+
+    good = True
+    start, end = OUTAGE[0], OUTAGE[0] + OUTAGE[1]
+    got_through = [t for t, lost in first.items()
+                   if start <= t < end and not lost]
+    if got_through:
+        api.userlog.error("Pings sent at %s got through during the outage",
+                          sorted(got_through))
+        good = False
+    if not any(lost for t, lost in first.items()
+               if not start <= t < end):
+        api.userlog.error("Nothing was lost outside the outage")
+        good = False
+    if first != second:
+        differ = [t for t in first if first[t] != second[t]]
+        api.userlog.error("Runs lost different pings (sent at %s)",
+                          sorted(differ))
+        good = False
+
+    if good:
+        api.userlog.debug("Test passed successfully!")
+    sys.exit(0 if good else 1)
@@ -0,0 +1,67 @@
+"""
+Tests that a parallel simulation converges to the same routes.
+
+Builds a random topology of routers and hosts and runs it for a while
+split across three workers (see sim.pdes).  Then builds the same topology
+in a normal single-process World and runs it for just as long.  The test
+passes if every router ends up with the same distance to every
+destination both times.
+
+"""
+
+import sim
+import sim.api as api
+import sim.core as core
+import sim.pdes as pdes
+import sys
+
+import topos.rand
+
+
+def build():
+    topos.rand.launch(switch_type=sim.config.default_switch_type,
+                      host_type=sim.config.default_host_type,
+                      switches=12, hosts=6, links=20, seed=3)
+
+
+def distances(entity):
+    table = getattr(entity, "routing_table", None)
+    if table is None:
+        return None
+    return dict((dst, table[dst][1]) for dst in table)
+
+
+def run_plain(until):
+    """Runs build() in a fresh World, like pdes.run() would, but without
+    splitting it up.  Returns the same kind of results."""
+    w = core.fresh_world()
+    build()
+    w.run_until(until)
+
+    results = {}
+    for entity in list(core.topo.keys()):
+        d = distances(entity)
+        if d is not None:
+            d = dict((dst.name, dist) for dst, dist in d.items())
+        results[entity.name] = d
+    return results
+
+
+def launch():
+    split = pdes.run(build, workers=3, until=60, collect=distances)
+    # pdes.run() set sim.config.seed, so this World gets the same seed
+    single = run_plain(60)
+
+    good = True
+    for name in sorted(single):
+        if single[name] != split.get(name):
+            api.userlog.error("%s has different routes: %s vs %s", name,
+                              single[name], split.get(name))
+            good = False
+    if not any(single.values()):
+        api.userlog.error("No routes were collected")
+        good = False
+
+    if good:
+        api.userlog.debug("Test passed successfully!")
+    sys.exit(0 if good else 1)
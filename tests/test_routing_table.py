@@ -0,0 +1,74 @@
+"""
+Tests that sim.basics.RoutingTable acts like a dict.
+
+Fills a RoutingTable and a plain dict the same way and checks that
+lookups, membership, iteration, deletion and the other dict methods give
+the same answers, including for keys that were never added.
+
+"""
+
+import sim.api as api
+import sim.basics as basics
+import sys
+
+
+def launch():
+    hosts = [basics.BasicHost.create('h%s' % (i, )) for i in range(4)]
+    h0, h1, h2, h3 = hosts
+
+    table = basics.RoutingTable({h2: (1, 2, 3)})
+    expected = {h2: (1, 2.0, 3.0)}
+    table[h0] = (0, 1.5, 2)
+    expected[h0] = (0, 1.5, 2.0)
+
+    errors = []
+
+    def check(what, got, wanted):
+        if got != wanted:
+            errors.append("%s: got %s, wanted %s" % (what, got, wanted))
+
+    check("dict()", dict(table), expected)
+    check("len()", len(table), 2)
+    check("iteration order", list(table), [h2, h0])
+    check("in", h2 in table, True)
+    check("not in", h1 in table, False)
+    check("get()", table.get(h0), (0, 1.5, 2.0))
+    check("get() missing", table.get(h3, "nope"), "nope")
+    check("non-Entity in", "x" in table, False)
+    check("non-Entity get()", table.get("x"), None)
+    check("get_distance()", table.get_distance(h2), 2.0)
+
+    for key in [h1, "x", None]:
+        try:
+            table[key]
+            errors.append("%r lookup didn't raise KeyError" % (key, ))
+        except KeyError:
+            pass
+
+    table[h2] = (3, 4, 5)
+    check("replace", table[h2], (3, 4.0, 5.0))
+    check("pop()", table.pop(h0), (0, 1.5, 2.0))
+    check("len() after pop()", len(table), 1)
+    try:
+        del table[h0]
+        errors.append("Deleting a missing key didn't raise KeyError")
+    except KeyError:
+        pass
+    table.clear()
+    check("len() after clear()", len(table), 0)
+    check("items() after clear()", list(table.items()), [])
+
+    # Lots of churn shouldn't leave lots of dead slots behind
+    for _ in range(50):
+        for h in hosts:
+            table[h] = (1, 1, 1)
+        del table[h1]
+        del table[h3]
+    check("churned iteration order", list(table), [h0, h2])
+    check("churned slots", len(table._keys) <= 2 * len(table) + 8, True)
+
+    for e in errors:
+        api.userlog.error(e)
+    if not errors:
+        api.userlog.debug("Test passed successfully!")
+    sys.exit(1 if errors else 0)
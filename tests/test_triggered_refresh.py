@@ -0,0 +1,65 @@
+"""
+Tests that triggered updates cut down on steady-state routing traffic.
+
+Builds the same random topology twice, each time in a fresh World: once
+with routers that send their whole table every timer, and once with
+TRIGGERED_UPDATES on.  Counts the routes sent once the network has had a
+minute to settle.  The test passes if both runs end up with the same
+distances and the triggered run sends fewer routes.
+
+"""
+
+import sim
+import sim.api as api
+import sim.core as core
+import sys
+
+import topos.rand
+
+
+STEADY = 60  # Only count routes sent after this
+UNTIL = 120
+
+
+def run_once(triggered):
+    """Runs the topology.  Returns (routes sent after STEADY, distances)."""
+    class CountingRouter(sim.config.default_switch_type):
+        TRIGGERED_UPDATES = triggered
+        sent = [0]
+
+        def send_routes(self, out_port, routes):
+            if api.current_time() >= STEADY:
+                self.sent[0] += len(routes)
+            super(CountingRouter, self).send_routes(out_port, routes)
+
+    w = core.fresh_world()
+    topos.rand.launch(switch_type=CountingRouter,
+                      host_type=sim.config.default_host_type,
+                      switches=15, hosts=5, links=25, seed=1)
+    w.run_until(UNTIL)
+
+    distances = {}
+    for entity in list(core.topo.keys()):
+        table = getattr(entity, "routing_table", None)
+        if table is not None:
+            distances[entity.name] = dict((dst.name, table[dst][1])
+                                          for dst in table)
+    return CountingRouter.sent[0], distances
+
+
+def launch():
+    periodic, periodic_distances = run_once(False)
+    triggered, triggered_distances = run_once(True)
+
+    good = True
+    if periodic_distances != triggered_distances:
+        api.userlog.error("Triggered updates ended up with different routes")
+        good = False
+    if not triggered < periodic:
+        api.userlog.error("Sent %s routes with triggered updates and %s "
+                          "without", triggered, periodic)
+        good = False
+
+    if good:
+        api.userlog.debug("Test passed successfully!")
+    sys.exit(0 if good else 1)
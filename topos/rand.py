@@ -25,7 +25,8 @@ def launch(switch_type=sim.config.default_switch_type,
 
     """
     if seed is None:
-        rand = random
+        import sim.core
+        rand = sim.core.world.rng("topos.rand")
     else:
         try:
             seed = float(seed)